@@ -4,10 +4,6 @@ taskr!
 this is our main wsgi entry point so any
 initial setup should happen here
 """
-# stdlib imports
-import os
-import sys
-
 # third-party imports
 import webapp2
 
@@ -15,8 +11,8 @@ import webapp2
 import settings
 import routes
 
-# Add lib directory to path
-sys.path.insert(0, os.path.join(settings.PROJECT_ROOT, 'lib'))
+# (lib/ is added to sys.path by appengine_config.py, which
+# appengine always imports before this module)
 
 # Define our WSGI app so GAE can run it
 wsgi = webapp2.WSGIApplication(
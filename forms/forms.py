@@ -1,6 +1,7 @@
 # third-party imports
 from google.appengine.ext import ndb
 from wtforms import Form
+from wtforms import HiddenField
 from wtforms import IntegerField
 from wtforms import SelectField
 from wtforms import TextField
@@ -35,24 +36,21 @@ class CommentForm(Form):
 def add_user_to_task_form(task, post_data):
 
     """
-    Factory function to allow building of selectfield
-    only forms for adding users to tasks
+    Factory function to allow building of forms for adding users
+    to tasks.  Users are picked with a typeahead backed by the user
+    directory API, so the form never has to list every user.
     """
 
-    @ndb.tasklet
-    def get_all_users():
-        # choices for select field
-        all_users = User.query().order(User.family_name)
-        all_users_list = yield all_users.map_async(lambda x: (x.key.urlsafe(), str(x.given_name) + ' ' + str(x.family_name)))
-        raise ndb.Return(all_users_list)
-
-    def choices():
-        # choices for select field
-        task_users = [x.urlsafe() for x in task.project.get().users]
-        all_users = get_all_users().get_result()
-        unassigned_users = [x for x in all_users if not x[0] in task_users]
-        unassigned_users = [('None', '--------')] + unassigned_users
-        return unassigned_users
+    def valid_user(form, field):
+        # make sure we've been given the key of a user not already on the project
+        try:
+            user_key = ndb.Key(urlsafe=field.data)
+        except Exception:
+            raise validators.ValidationError('Not a valid user')
+        if user_key.kind() != User._get_kind():
+            raise validators.ValidationError('Not a valid user')
+        if user_key in task.users:
+            raise validators.ValidationError('User already added to project')
 
     class AddUserToTaskForm(Form):
 
@@ -60,8 +58,8 @@ def add_user_to_task_form(task, post_data):
         Form to allow adding users to tasks
         """
 
-        # user task is assigned to
-        user = SelectField(u'Add user to project', choices=choices())
+        # user to add to task
+        user = HiddenField(u'Add user to project', [validators.DataRequired(), valid_user])
 
     # init form
     form = AddUserToTaskForm(post_data)
@@ -8,14 +8,9 @@ import sys
 
 # third-party imports
 import webapp2
-from httplib import HTTPException
-from raven import Client
 
 # local imports
-import secrets
-
-# check if sentry enabled
-client = Client(secrets.SENTRY_DSN)
+from utils.sentry import capture_exception
 
 
 class JsonHandler(webapp2.RequestHandler):
@@ -48,25 +43,8 @@ class JsonHandler(webapp2.RequestHandler):
         server when not in DEBUG mode.
         """
 
-        # build our error report
-        error_report = {
-            'method': self.request.method,
-            'url': self.request.path_url,
-            'query_string': self.request.query_string,
-            # 'data': environ.get('wsgi.input'),
-            'headers': dict(self.request.headers),
-            'env': dict((
-                    ('REMOTE_ADDR', self.request.environ['REMOTE_ADDR']),
-                    ('SERVER_NAME', self.request.environ['SERVER_NAME']),
-                    ('SERVER_PORT', self.request.environ['SERVER_PORT']),
-                )),
-            }
-        interface = 'sentry.interfaces.Http'
-
-        try:
-            client.captureException(data={interface: error_report})
-        except HTTPException:
-            logging.warning('Unable to contact sentry server')
+        # queue error report, delivered to sentry in the background
+        capture_exception(self.request)
 
         # Log the exception
         logging.exception(exception)
@@ -0,0 +1,40 @@
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from handlers.api.base import JsonHandler
+from utils.auth import get_principal
+from utils.directory import search_directory
+
+
+class UserDirectoryHandler(JsonHandler):
+
+    """
+    Paginated prefix search over the user directory, used by the
+    typeahead on the add user form.  Users already on the project
+    are left out of the results.
+    """
+
+    def get(self, task_id):
+
+        # only admins can add users to projects
+        principal = get_principal(self.request)
+        if principal.user_entity is None or not principal.is_admin:
+            return self.abort(403, detail="Admin permissions required")
+
+        # get project from datastore
+        task = ndb.Key(urlsafe=task_id).get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
+
+        # parse search params
+        prefix = self.request.get('q')
+        try:
+            offset = int(self.request.get('offset', default_value='0'))
+        except ValueError:
+            return self.abort(400, detail='Invalid offset')
+
+        # search directory, skipping existing project members
+        exclude = set(x.urlsafe() for x in task.users)
+        results, next_offset = search_directory(prefix, offset=offset, exclude=exclude)
+        return self.render_response({'results': results, 'next_offset': next_offset})
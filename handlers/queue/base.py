@@ -0,0 +1,49 @@
+"""
+Base task queue handlers
+"""
+# third-party imports
+import webapp2
+
+
+class QueueHandler(webapp2.RequestHandler):
+
+    """
+    Base handler for all handlers that are only
+    ever invoked by the task queue
+    """
+
+    def dispatch(self):
+
+        """
+        Override dispatch() to reject any request that
+        didn't come from the task queue
+        """
+
+        # appengine strips this header from all external requests
+        if 'X-AppEngine-QueueName' not in self.request.headers:
+            return self.abort(403, detail="Task queue requests only")
+
+        # Dispatch the request.
+        webapp2.RequestHandler.dispatch(self)
+
+
+class CronHandler(webapp2.RequestHandler):
+
+    """
+    Base handler for all handlers that are only
+    ever invoked by cron
+    """
+
+    def dispatch(self):
+
+        """
+        Override dispatch() to reject any request that
+        didn't come from cron
+        """
+
+        # appengine strips this header from all external requests
+        if 'X-AppEngine-Cron' not in self.request.headers:
+            return self.abort(403, detail="Cron requests only")
+
+        # Dispatch the request.
+        webapp2.RequestHandler.dispatch(self)
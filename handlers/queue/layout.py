@@ -0,0 +1,29 @@
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from handlers.queue.base import QueueHandler
+from models.layout import MIGRATION_RETRY_LIMIT
+from models.layout import migrate_project_to_path_layout
+from models.layout import migration_failed
+
+
+class LayoutMigrationHandler(QueueHandler):
+
+    """
+    Moves all the tasks of a project into the path layout
+    """
+
+    def post(self):
+
+        # rebuild project key from the queued params
+        project_key = ndb.Key(urlsafe=self.request.get('project_key'))
+        # move tasks, picking up where any earlier attempt stopped
+        try:
+            migrate_project_to_path_layout(project_key)
+        except Exception:
+            # don't leave the project locked once out of retries
+            retries = int(self.request.headers.get('X-AppEngine-TaskRetryCount', 0))
+            if retries >= MIGRATION_RETRY_LIMIT:
+                migration_failed(project_key)
+            raise
@@ -0,0 +1,20 @@
+# local imports
+from handlers.queue.base import QueueHandler
+from utils.backfills import MIGRATIONS
+from utils.migration import run_batch
+
+
+class MigrationHandler(QueueHandler):
+
+    """
+    Runs a single batch of a migration and queues the next
+    """
+
+    def post(self):
+
+        # look up the migration this batch belongs to
+        migration = MIGRATIONS.get(self.request.get('name'))
+        if migration is None:
+            return self.abort(404, detail='No such migration')
+        # migrate batch and record progress
+        run_batch(migration, int(self.request.get('run')), int(self.request.get('attempt', default_value='0')))
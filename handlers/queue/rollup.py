@@ -0,0 +1,21 @@
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from handlers.queue.base import QueueHandler
+from models.task import Task
+
+
+class RollupHandler(QueueHandler):
+
+    """
+    Refreshes the rolled up values of a task and its
+    ancestors after one or more deferred edits
+    """
+
+    def post(self):
+
+        # rebuild task key from the queued params
+        task_key = ndb.Key(urlsafe=self.request.get('task_key'))
+        # recalculate from stored subtasks and send change up the key path
+        Task.refresh_rollups(task_key)
@@ -0,0 +1,35 @@
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from handlers.queue.base import CronHandler
+from handlers.queue.base import QueueHandler
+from utils.scrubber import schedule_scrubs
+from utils.scrubber import scrub_project
+
+
+class ScheduleScrubsHandler(CronHandler):
+
+    """
+    Queues a rollup scrub of every project
+    """
+
+    def get(self):
+
+        # fan out one scrub per project
+        count = schedule_scrubs()
+        self.response.write('Queued %d project scrubs' % count)
+
+
+class ScrubHandler(QueueHandler):
+
+    """
+    Checks and repairs the stored rollups of a single project
+    """
+
+    def post(self):
+
+        # rebuild project key from the queued params
+        project_key = ndb.Key(urlsafe=self.request.get('project_key'))
+        # recalculate from scratch and repair any drift
+        scrub_project(project_key)
@@ -0,0 +1,16 @@
+# local imports
+from handlers.queue.base import CronHandler
+from utils.sentry import flush_events
+
+
+class FlushSentryHandler(CronHandler):
+
+    """
+    Delivers queued error reports to sentry
+    """
+
+    def get(self):
+
+        # send as many queued events as we can
+        count = flush_events()
+        self.response.write('Delivered %d events' % count)
@@ -3,7 +3,7 @@ from google.appengine.api import users
 
 # local imports
 from handlers.template.base import TemplateHandler
-from models.auth import User
+from utils.auth import get_principal
 
 
 class AuthedTemplateHandler(TemplateHandler):
@@ -19,15 +19,14 @@ class AuthedTemplateHandler(TemplateHandler):
         """
 
         # make sure user is logged in
-        user = users.get_current_user()
-        if user is None:
+        principal = get_principal(self.request)
+        if principal.google_user is None:
             # redirect user to login page if not logged in
             redirect_url = users.create_login_url(self.request.path_qs)
             return self.redirect(redirect_url)
 
-        # get user entity from datastore
-        user_entity_id = 'user-' + user.user_id()
-        user_entity = User.get_by_id(user_entity_id)
+        # get user entity from datastore (shared with the rest of the request)
+        user_entity = principal.user_entity
 
         # ensure user entity exists and has complete profile
         if user_entity is None or not user_entity.has_profile:
@@ -51,8 +50,8 @@ class CallbackHandler(TemplateHandler):
     def get(self):
 
         # make sure user is logged in
-        user = users.get_current_user()
-        if user is None:
+        principal = get_principal(self.request)
+        if principal.google_user is None:
             self.abort(401)
 
         # make sure this is a valid oauth2 callback
@@ -61,9 +60,7 @@ class CallbackHandler(TemplateHandler):
             return self.abort(400, detail='Not a valid OAuth2 callback')
 
         # pull user entity from datastore and set credentials
-        user_key = 'user-' + user.user_id()
-        user_entity = User.get_by_id(user_key)
-        user_entity.set_credentials(code)
+        principal.user_entity.set_credentials(code)
 
         # redirect to specified URL
         redirect_url = self.request.get('state')
@@ -1,25 +1,19 @@
 """
 Base template handlers
 """
-# stdlib imports
-import logging
-
 # third-party imports
 import webapp2
-from babel.dates import format_timedelta
-from google.appengine.api import users
-from httplib import HTTPException
-from raven import Client
-from webapp2_extras import jinja2
-from webapp2_extras import sessions
 
 # local imports
-import secrets
-from models.auth import User
+from utils.auth import get_principal
 from utils.auth import is_admin
+from utils.sentry import capture_exception
+
 
-# check if sentry enabled
-client = Client(secrets.SENTRY_DSN)
+def format_timedelta(*args, **kwargs):
+    # babel (and its locale data) is only loaded once a page uses it
+    from babel.dates import format_timedelta
+    return format_timedelta(*args, **kwargs)
 
 
 class TemplateHandler(webapp2.RequestHandler):
@@ -35,6 +29,7 @@ class TemplateHandler(webapp2.RequestHandler):
         """
 
         # Get a session store for this request.
+        from webapp2_extras import sessions
         self.session_store = sessions.get_store(request=self.request)
 
         try:
@@ -70,16 +65,11 @@ class TemplateHandler(webapp2.RequestHandler):
 
         }
 
-        # check if user is logged in
-        user = users.get_current_user()
-        if user is not None:
-            # get user from datastore
-            user_key = 'user-' + user.user_id()
-            user_entity = User.get_by_id(user_key)
-            # add user to context
-            context['user'] = user_entity
-        else:
-            context['user'] = None
+        # add the logged in user (None if logged out), looked
+        # up once per request and shared with the handler
+        principal = get_principal(self.request)
+        context['principal'] = principal
+        context['user'] = principal.user_entity
 
         # return default context
         return context
@@ -87,8 +77,19 @@ class TemplateHandler(webapp2.RequestHandler):
     @webapp2.cached_property
     def jinja2(self):
         # Returns a Jinja2 renderer cached in the app registry.
+        from webapp2_extras import jinja2
         return jinja2.get_jinja2(app=self.app)
 
+    def render_fragment(self, _template, context):
+
+        """
+        Renders a template (with the default context) to a string,
+        for pieces of pages that are cached separately.
+        """
+
+        context.update(self.default_context())
+        return self.jinja2.render_template(_template, **context)
+
     def render_response(self, _template, context):
 
         """
@@ -109,23 +110,6 @@ class TemplateHandler(webapp2.RequestHandler):
         server when not in DEBUG mode.
         """
 
-        # build our error report
-        error_report = {
-            'method': self.request.method,
-            'url': self.request.path_url,
-            'query_string': self.request.query_string,
-            # 'data': environ.get('wsgi.input'),
-            'headers': dict(self.request.headers),
-            'env': dict((
-                    ('REMOTE_ADDR', self.request.environ['REMOTE_ADDR']),
-                    ('SERVER_NAME', self.request.environ['SERVER_NAME']),
-                    ('SERVER_PORT', self.request.environ['SERVER_PORT']),
-                )),
-            }
-        interface = 'sentry.interfaces.Http'
-
-        try:
-            client.captureException(data={interface: error_report})
-        except HTTPException:
-            logging.warning('Unable to contact sentry server')
+        # queue error report, delivered to sentry in the background
+        capture_exception(self.request)
         super(TemplateHandler, self).handle_exception(exception, debug)
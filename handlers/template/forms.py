@@ -5,6 +5,7 @@ from __future__ import absolute_import
 from google.appengine.ext import ndb
 
 # local imports
+import settings
 from forms.forms import CommentForm
 from forms.forms import TaskForm
 from forms.forms import add_user_to_task_form
@@ -13,9 +14,34 @@ from forms.forms import reassign_task_form
 from handlers.template.auth import AuthedTemplateHandler
 from models.comment import Comment
 from models.history import add_to_history
+from models.layout import schedule_layout_migration
+from models.task import PATH_LAYOUT
 from models.task import Task
 from utils.auth import authed_for_task
 from utils.auth import is_admin
+from utils.auth import set_project_member
+from utils.errors import ProjectMigratingError
+
+
+class FormHandler(AuthedTemplateHandler):
+
+    """
+    Base handler for all form handlers, turning writes refused
+    while a project is being migrated into a flash message
+    """
+
+    def handle_exception(self, exception, debug):
+
+        # anything else is a genuine error
+        if not isinstance(exception, ProjectMigratingError):
+            return super(FormHandler, self).handle_exception(exception, debug)
+
+        # nothing was saved, tell the user why and send them back
+        self.session.add_flash('This project is being moved, please try again in a few minutes')
+        task_id = self.request.route_kwargs.get('task_id')
+        if task_id is None:
+            return self.redirect(self.uri_for('projects'))
+        return self.redirect(self.uri_for('task-view', task_id=task_id))
 
 
 ##################################
@@ -23,7 +49,7 @@ from utils.auth import is_admin
 ##################################
 
 
-class AddProjectHandler(AuthedTemplateHandler):
+class AddProjectHandler(FormHandler):
 
     """
     Form handler to allow admin users to add new top-level
@@ -43,7 +69,7 @@ class AddProjectHandler(AuthedTemplateHandler):
         if self.request.method == 'POST' and form.validate():
 
             # create new project
-            task = Task()
+            task = Task(layout=settings.DEFAULT_TASK_LAYOUT)
 
             # populate task from form
             form.populate_obj(task)
@@ -67,7 +93,7 @@ class AddProjectHandler(AuthedTemplateHandler):
         return self.render_response('task_form.html', context)
 
 
-class AddUserToProjectHandler(AuthedTemplateHandler):
+class AddUserToProjectHandler(FormHandler):
 
     """
     POST handler to allow adding users to
@@ -83,6 +109,8 @@ class AddUserToProjectHandler(AuthedTemplateHandler):
         # get task from datastore
         task_key = ndb.Key(urlsafe=task_id)
         task = task_key.get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
 
         # if this isn't a project then we can't add users to it
         if not task.is_top_level:
@@ -92,17 +120,21 @@ class AddUserToProjectHandler(AuthedTemplateHandler):
         form = add_user_to_task_form(task, self.request.POST)
 
         # check if form validates
-        if form.validate() and form.user.data is not None:
+        if form.validate():
 
             # coerce form data into valid datastore data
             data = ndb.Key(urlsafe=form.user.data)
+            user = data.get()
+            if user is None:
+                return self.abort(404, detail='User not found')
             # reassign task
             task.users.append(data)
-            # store task
+            # store task and update cached membership
             task.put()
+            set_project_member(task.key, data, True)
 
             # record history item
-            history_text = 'Added user:%s to project' % data.get().given_name
+            history_text = 'Added user:%s to project' % user.given_name
             add_to_history(task, self.user_entity, history_text)
             self.session.add_flash(history_text)
 
@@ -117,7 +149,7 @@ class AddUserToProjectHandler(AuthedTemplateHandler):
         return self.redirect(redirect_url)
 
 
-class RemoveUserFromProjectHandler(AuthedTemplateHandler):
+class RemoveUserFromProjectHandler(FormHandler):
 
     """
     POST only route allowing to delete users from projects
@@ -130,6 +162,8 @@ class RemoveUserFromProjectHandler(AuthedTemplateHandler):
         # pull task from datastore
         task_key = ndb.Key(urlsafe=task_id)
         task = task_key.get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
 
         if not task.is_top_level:
             return self.abort(403, detail="Can only remove users from projects")
@@ -146,6 +180,8 @@ class RemoveUserFromProjectHandler(AuthedTemplateHandler):
         # re-save task so as to recalculate all computed
         # fields right the way up to project level
         task.put()
+        # update cached membership
+        set_project_member(task.key, user_key, False)
 
         # add flash msg to indicate success
         self.session.add_flash('User successfully removed from task')
@@ -155,12 +191,46 @@ class RemoveUserFromProjectHandler(AuthedTemplateHandler):
         return self.redirect(redirect_url)
 
 
+class MigrateProjectLayoutHandler(FormHandler):
+
+    """
+    POST only route allowing admins to move a project's
+    tasks into the path layout (runs in the background)
+    """
+
+    def post(self, task_id):
+
+        # only admin users can migrate projects
+        if not is_admin(self.user_entity):
+            return self.abort(401, detail="Admin permissions required")
+
+        # pull task from datastore
+        task_key = ndb.Key(urlsafe=task_id)
+        task = task_key.get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
+
+        if not task.is_top_level:
+            return self.abort(403, detail="Can only migrate projects")
+
+        # queue migration unless already done or under way
+        if task.layout == PATH_LAYOUT or task.migrating:
+            self.session.add_flash('Project already moved to path layout')
+        else:
+            schedule_layout_migration(task.key)
+            self.session.add_flash('Project is being moved to path layout')
+
+        # redirect to task view page
+        redirect_url = self.uri_for('task-view', task_id=task.key.urlsafe())
+        return self.redirect(redirect_url)
+
+
 #############################
 # User-facing form handlers #
 #############################
 
 
-class AddTaskHandler(AuthedTemplateHandler):
+class AddTaskHandler(FormHandler):
 
     """
     Form to allow adding a new task
@@ -168,14 +238,19 @@ class AddTaskHandler(AuthedTemplateHandler):
 
     def handle(self, task_id):
 
-        # create new task (with parent)
+        # get parent task from datastore
         parent_task_key = ndb.Key(urlsafe=task_id)
-        task = Task(parent=parent_task_key)
+        parent_task = parent_task_key.get()
+        if parent_task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
 
         # check if user is authed to add task
-        if not authed_for_task(parent_task_key.get(), self.user_entity):
+        if not authed_for_task(parent_task, self.user_entity):
             return self.abort(401)
 
+        # create new task (placed according to the project's layout)
+        task = parent_task.new_subtask()
+
         # init form object with POST data
         form = TaskForm(self.request.POST)
 
@@ -200,7 +275,7 @@ class AddTaskHandler(AuthedTemplateHandler):
         return self.render_response('task_form.html', context)
 
 
-class EditTaskHandler(AuthedTemplateHandler):
+class EditTaskHandler(FormHandler):
 
     """
     Form handler to allow admin users to add new top-level
@@ -247,7 +322,7 @@ class EditTaskHandler(AuthedTemplateHandler):
         return self.render_response('task_form.html', context)
 
 
-class ReassignTaskHandler(AuthedTemplateHandler):
+class ReassignTaskHandler(FormHandler):
 
     """
     POST handler to allow reassigning task to another user
@@ -258,6 +333,8 @@ class ReassignTaskHandler(AuthedTemplateHandler):
         # get task from datastore
         task_key = ndb.Key(urlsafe=task_id)
         task = task_key.get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
 
         # check if user is authed to reassign task
         if not authed_for_task(task, self.user_entity):
@@ -306,7 +383,7 @@ class ReassignTaskHandler(AuthedTemplateHandler):
         return self.redirect(redirect_url)
 
 
-class ChangeCompletionStatusTaskHandler(AuthedTemplateHandler):
+class ChangeCompletionStatusTaskHandler(FormHandler):
 
     """
     Form to allow altering completion status of tasks
@@ -317,6 +394,8 @@ class ChangeCompletionStatusTaskHandler(AuthedTemplateHandler):
         # get task from datastore
         task_key = ndb.Key(urlsafe=task_id)
         task = task_key.get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
 
         # check if user is authed to reassign task
         if not authed_for_task(task, self.user_entity):
@@ -331,9 +410,10 @@ class ChangeCompletionStatusTaskHandler(AuthedTemplateHandler):
             # get original status before changing
             from_status = task.task_completion_status
 
-            # populate task from form and save
+            # populate task from form and save, leaving the
+            # ancestors to be rolled up in the background
             form.populate_obj(task)
-            task.put()
+            task.put(defer_rollup=True)
 
             # add history record
             to_status = form.task_completion_status.data
@@ -354,7 +434,7 @@ class ChangeCompletionStatusTaskHandler(AuthedTemplateHandler):
         return self.redirect(redirect_url)
 
 
-class AddCommentHandler(AuthedTemplateHandler):
+class AddCommentHandler(FormHandler):
 
     """
     Form to allow adding a comment to a task
@@ -362,11 +442,14 @@ class AddCommentHandler(AuthedTemplateHandler):
 
     def post(self, task_id):
 
-        # create new task (with parent)
+        # get task from datastore
         task_key = ndb.Key(urlsafe=task_id)
+        task = task_key.get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
 
-        # check if user is authed to reassign task
-        if not authed_for_task(task_key.get(), self.user_entity):
+        # check if user is authed to comment on task
+        if not authed_for_task(task, self.user_entity):
             return self.abort(401)
 
         # get user key
@@ -384,12 +467,13 @@ class AddCommentHandler(AuthedTemplateHandler):
             # set reference properties on comment object
             comment.task = task_key
             comment.user = user_key
-            # store comment
-            comment.put()
+            # store comment (only the comment and its counter are
+            # written, never the task), unless the project is moving
+            task.write_checked(to_put=[comment])
 
             # record history item
             history_text = 'Comment added'
-            add_to_history(task_key.get(), self.user_entity, history_text)
+            add_to_history(task, self.user_entity, history_text)
 
             # add a flash message to session
             self.session.add_flash(history_text)
@@ -405,7 +489,7 @@ class AddCommentHandler(AuthedTemplateHandler):
         return self.redirect(redirect_url)
 
 
-class DeleteCommentHandler(AuthedTemplateHandler):
+class DeleteCommentHandler(FormHandler):
 
     """
     POST only route allowing to delete comments
@@ -416,8 +500,8 @@ class DeleteCommentHandler(AuthedTemplateHandler):
         # reconstruct comment key and pull entity from datastore
         comment_key = ndb.Key(urlsafe=comment_id)
         comment = comment_key.get()
-        # pull task from datastore
-        task = comment.task.get()
+        if comment is None:
+            return self.abort(404, detail='Comment not found')
 
         if not comment.task.urlsafe() == task_id:
             return self.abort(400, detail='Task/Comment mismatch')
@@ -426,15 +510,17 @@ class DeleteCommentHandler(AuthedTemplateHandler):
         if not self.user_entity.key == comment.user and not is_admin(self.user_entity):
             return self.abort(403, detail="Users can only delete their own comments")
 
-        # delete comment entity
-        comment_key.delete()
-        # re-save task so as to recalculate all computed
-        # fields right the way up to project level
-        task.put()
+        task = comment.task.get()
+        if task is None:
+            return self.abort(404, detail='Task not found: %s' % task_id)
+
+        # delete comment entity (the task's comment counter is
+        # decremented as it's deleted), unless the project is moving
+        task.write_checked(to_delete=[comment_key])
 
         # add flash msg to indicate success
         self.session.add_flash('Comment successfully deleted')
 
         # redirect to task view page
-        redirect_url = self.uri_for('task-view', task_id=task.key.urlsafe())
+        redirect_url = self.uri_for('task-view', task_id=comment.task.urlsafe())
         return self.redirect(redirect_url)
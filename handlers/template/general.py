@@ -1,8 +1,6 @@
-# third-party imports
-from google.appengine.api import users
-
 # local imports
 from handlers.template.base import TemplateHandler
+from utils.auth import get_principal
 
 
 class IndexHandler(TemplateHandler):
@@ -14,7 +12,7 @@ class IndexHandler(TemplateHandler):
     def get(self):
 
         # redirect to projects page if already logged in
-        if users.get_current_user() is not None:
+        if get_principal(self.request).google_user is not None:
             redirect_url = self.uri_for('projects')
             return self.redirect(redirect_url)
 
@@ -0,0 +1,65 @@
+# marty mcfly imports
+from __future__ import absolute_import
+
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from handlers.template.auth import AuthedTemplateHandler
+from models.migration import MigrationStatus
+from utils.auth import is_admin
+from utils.backfills import MIGRATIONS
+from utils.migration import pause_migration
+from utils.migration import resume_migration
+from utils.migration import start_migration
+
+
+class MigrationsHandler(AuthedTemplateHandler):
+
+    """
+    Admin only page listing all data migrations and their
+    progress, and allowing them to be started, paused or resumed
+    """
+
+    def get(self):
+
+        # check if user has admin permissions
+        if not is_admin(self.user_entity):
+            return self.abort(401, detail="Admin permissions required")
+
+        # get status of every migration in one batch
+        migrations = sorted(MIGRATIONS.values(), key=lambda x: x.name)
+        statuses = ndb.get_multi([ndb.Key(MigrationStatus, x.name) for x in migrations])
+        rows = [{'migration': x, 'status': y} for x, y in zip(migrations, statuses)]
+
+        # render template and return
+        return self.render_response('migrations.html', {'rows': rows})
+
+    def post(self, name, action):
+
+        # check if user has admin permissions
+        if not is_admin(self.user_entity):
+            return self.abort(401, detail="Admin permissions required")
+
+        migration = MIGRATIONS.get(name)
+        if migration is None:
+            return self.abort(404, detail='No such migration')
+
+        # optional throttling settings
+        batch_size = self.request.get('batch_size', default_value='')
+        countdown = self.request.get('countdown', default_value='')
+        batch_size = int(batch_size) if batch_size.isdigit() else None
+        countdown = int(countdown) if countdown.isdigit() else None
+
+        if action == 'start':
+            start_migration(migration, batch_size, countdown or 0)
+        elif action == 'pause':
+            pause_migration(migration)
+        elif action == 'resume':
+            resume_migration(migration, batch_size, countdown)
+        else:
+            return self.abort(400, detail='Unknown action')
+
+        # add flash msg and redirect back to the list
+        self.session.add_flash('Migration %s: %s' % (name, action))
+        return self.redirect(self.uri_for('migrations'))
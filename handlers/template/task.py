@@ -5,18 +5,18 @@ from __future__ import absolute_import
 import logging
 
 # third-party imports
+from google.appengine.api import datastore_errors
 from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 # local imports
-from forms.forms import CommentForm
-from forms.forms import add_user_to_task_form
-from forms.forms import completion_task_form
-from forms.forms import reassign_task_form
 from handlers.template.auth import AuthedTemplateHandler
+from models.task import PATH_LAYOUT
 from models.task import Task
+from utils import fragments
 from utils.auth import authed_for_task
 from utils.auth import is_admin
+from utils.loader import ReferenceLoader
 
 
 class ProjectHandler(AuthedTemplateHandler):
@@ -26,26 +26,39 @@ class ProjectHandler(AuthedTemplateHandler):
     projects if an admin user
     """
 
+    # number of projects shown per page
+    page_size = 20
+
     def get(self):
 
-        @ndb.tasklet
-        def get_projects_for_user_async(user_key, admin_permissions):
-            # base projects query
-            projects = Task.query().filter(Task.is_top_level == True)
-            # filter projects if user is not an admin
-            if not admin_permissions:
-                projects = projects.filter(Task.users == user_key)
-            # sort projects by creation date
-            projects = projects.order(Task.creation_time)
-            project_list = yield projects.map_async(lambda x: x.key)
-            raise ndb.Return(project_list)
-
-        # run async query to get projects
-        admin_permissions = is_admin(self.user_entity)
-        user_key = self.user_entity.key
-        projects = get_projects_for_user_async(user_key, admin_permissions)
+        # base projects query
+        projects = Task.query().filter(Task.is_top_level == True)
+        # filter projects if user is not an admin
+        if not is_admin(self.user_entity):
+            projects = projects.filter(Task.users == self.user_entity.key)
+        # sort projects by creation date
+        projects = projects.order(Task.creation_time)
+
+        # get a page of project keys, starting from the cursor if given
+        cursor = self.request.get('cursor', default_value=None)
+        try:
+            if cursor is not None:
+                cursor = Cursor(urlsafe=cursor)
+            project_keys, next_cursor, more = projects.fetch_page(
+                self.page_size, start_cursor=cursor, keys_only=True)
+        except (datastore_errors.BadValueError, datastore_errors.BadRequestError):
+            return self.abort(400, detail='Invalid cursor')
+        # build page from cached project summaries
+        projects = Task.get_summaries(project_keys)
+        # fetch every user referenced on the page in one batch
+        refs = ReferenceLoader().prime(x.assigned_to for x in projects).load()
         # add projects to the template context
-        context = {'projects': ndb.get_multi_async(projects.get_result())}
+        context = {
+            'projects': projects,
+            'refs': refs,
+            'cursor': cursor,
+            'next_cursor': next_cursor if more else None,
+        }
         # render and return login page
         return self.render_response('projects.html', context)
 
@@ -62,6 +75,11 @@ class ViewTaskHandler(AuthedTemplateHandler):
         # get task from datastore using ID passed in URL
         task_key = ndb.Key(urlsafe=task_id)
         task = task_key.get()
+        # tasks moved to the path layout get new keys, follow them
+        if task is None:
+            moved_key = Task.query(Task.migrated_from == task_key).get(keys_only=True)
+            if moved_key is not None:
+                return self.redirect(self.uri_for('task-view', task_id=moved_key.urlsafe()), permanent=True)
         # throw 404 if task not found
         if task_key is None or task is None:
             return self.abort(404, detail='Task not found: %s' % task_id)
@@ -70,33 +88,84 @@ class ViewTaskHandler(AuthedTemplateHandler):
         if not authed_for_task(task, self.user_entity):
             return self.abort(401, detail="Unauthorised for task")
 
-        # get subtasks from datastore
-        subtasks = ndb.get_multi_async(task.subtasks)
-        # get list of users from datastore
-        task_users = ndb.get_multi_async(task.users)
+        # wtforms is only loaded by pages that have forms on them
+        from forms.forms import CommentForm
+        from forms.forms import add_user_to_task_form
+        from forms.forms import completion_task_form
+        from forms.forms import reassign_task_form
+
+        # rendered subtask and history tables, if cached
+        # since anything in this task's project last changed
+        generation = fragments.get_generation(task.project)
+        cached = fragments.get_fragments(task.key, generation, ['subtask_table', 'history_table'])
+
+        # get display fields of subtasks from datastore (only if needed)
+        subtasks = None
+        if 'subtask_table' not in cached:
+            subtasks = task.subtask_summaries()
         # get page of comments
         if comment_cursor is not None:
-            comment_cursor = Cursor(urlsafe=comment_cursor)
+            try:
+                comment_cursor = Cursor(urlsafe=comment_cursor)
+            except datastore_errors.BadValueError:
+                return self.abort(400, detail='Invalid comment cursor')
         comments = task.comments().fetch_page_async(5, start_cursor=comment_cursor)
+        if subtasks is not None:
+            subtasks = subtasks.get_result()
+        comments = comments.get_result()
+        # comment total is read once and shown in two places
+        comments_count = task.comments_count
+        # fetch every user referenced on the page (assignees,
+        # commenters and project members) in one batch
+        refs = ReferenceLoader()
+        if subtasks is not None:
+            refs.prime(x.assigned_to for x in subtasks)
+        refs.prime(x.user for x in comments[0])
+        refs.prime(task.users)
+        refs.load()
+
+        # render and cache any tables that weren't cached
+        rendered = {}
+        if subtasks is not None:
+            rendered['subtask_table'] = self.render_fragment('subtask_table.html', {
+                'subtasks': subtasks,
+                'refs': refs,
+                'projects_or_tasks': 'subtasks',
+            })
+        if 'history_table' not in cached:
+            rendered['history_table'] = self.render_fragment('history_table.html', {
+                'task': task,
+                'history': task.history,
+            })
+        if rendered:
+            fragments.set_fragments(task.key, generation, rendered)
+            cached.update(rendered)
+        task_users = [refs(x) for x in task.users]
         # form to allow altering of completion status
         completion_form = completion_task_form(task, self.request.POST)
         # form to allow adding comments
         comment_form = CommentForm()
         # for to allow reassigning of task
         reassign_form = reassign_task_form(task, self.request.POST)
-        # form to allow adding users to projects
-        add_user_form = add_user_to_task_form(task, self.request.POST)
+        # form to allow adding users to projects (admins only)
+        add_user_form = None
+        if task.is_top_level and is_admin(self.user_entity):
+            add_user_form = add_user_to_task_form(task, self.request.POST)
         # add all required objects to context dict
         context = {
             'task': task,
-            'subtasks': subtasks,
+            'subtask_table': cached['subtask_table'],
+            'history_table': cached['history_table'],
             'comment_form': comment_form,
             'reassign_form': reassign_form,
             'task_users': task_users,
             'completion_form': completion_form,
             'comments': comments,
+            'comments_count': comments_count,
             'comment_cursor': comment_cursor,
             'add_user_form': add_user_form,
+            'refs': refs,
+            'PATH_LAYOUT': PATH_LAYOUT,
         }
         # render template and return
         return self.render_response('task.html', context)
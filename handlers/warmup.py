@@ -0,0 +1,78 @@
+"""
+Warmup handler, run by appengine on every new instance before
+it's sent any user requests (see inbound_services in app.yaml)
+"""
+# stdlib imports
+import datetime
+import logging
+import time
+
+# third-party imports
+import webapp2
+from webapp2_extras import jinja2
+
+# local imports
+import routes
+
+# templates rendered on most pages, compiled ahead of time
+WARMUP_TEMPLATES = [
+    'base.html',
+    'task.html',
+    'subtask_table.html',
+    'history_table.html',
+    'projects.html',
+]
+
+
+class WarmupHandler(webapp2.RequestHandler):
+
+    """
+    Does all the one-off work of a new instance up front (importing
+    handlers and libraries, compiling templates and loading locale
+    data) and reports how long each step took.
+    """
+
+    def get(self):
+
+        timings = []
+
+        def step(name, func):
+            start = time.time()
+            func()
+            timings.append((name, time.time() - start))
+
+        step('handlers', self.import_handlers)
+        step('libraries', self.import_libraries)
+        step('templates', self.compile_templates)
+        step('locale', self.load_locale)
+
+        # log and return timings of every step
+        report = ['%s: %.1fms' % (name, secs * 1000) for name, secs in timings]
+        report.append('total: %.1fms' % (sum(x[1] for x in timings) * 1000))
+        logging.info('Warmup done, %s', ', '.join(report))
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('\n'.join(report))
+
+    def import_handlers(self):
+        # every handler module routes.py refers to (normally imported
+        # by webapp2 on the first request that hits one of its routes)
+        for route in routes.ROUTES:
+            if isinstance(route.handler, basestring):
+                webapp2.import_string(route.handler)
+
+    def import_libraries(self):
+        # vendored libraries used while handling requests
+        import babel.dates
+        import raven
+        import wtforms
+
+    def compile_templates(self):
+        # templates are compiled once and cached by the jinja2 environment
+        environment = jinja2.get_jinja2(app=self.app).environment
+        for name in WARMUP_TEMPLATES:
+            environment.get_template(name)
+
+    def load_locale(self):
+        # first use of a locale unpickles its data from disk
+        from babel.dates import format_timedelta
+        format_timedelta(datetime.timedelta(minutes=1), locale='en_GB')
@@ -2,10 +2,12 @@
 import datetime
 import hashlib
 import json
+import time
 import urllib
 
 # third-party imports
 import webapp2
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
 from oauth2client.client import OAuth2WebServerFlow
@@ -16,6 +18,29 @@ from models.base import BaseModel
 from utils.appinfo import application_url
 from utils.errors import AccessTokenRefreshError
 
+# memcache key of the counter that versions the cached user directory
+USER_DIRECTORY_VERSION = 'user-directory:version'
+
+
+def _initial_directory_version():
+    # versions start from the current time, so one evicted from
+    # memcache never restarts at a number it's already used
+    return int(time.time())
+
+
+def get_directory_version():
+    # current version of the cached user directory
+    version = memcache.get(USER_DIRECTORY_VERSION)
+    if version is None:
+        memcache.add(USER_DIRECTORY_VERSION, _initial_directory_version())
+        version = memcache.get(USER_DIRECTORY_VERSION) or _initial_directory_version()
+    return version
+
+
+def bump_directory_version():
+    # invalidate the cached user directory
+    memcache.incr(USER_DIRECTORY_VERSION, initial_value=_initial_directory_version())
+
 
 class User(BaseModel):
 
@@ -54,6 +79,15 @@ class User(BaseModel):
             return False
         return True
 
+    @property
+    def full_name(self):
+        # name used when displaying this user, users who haven't
+        # filled in their profile yet go by their email (if any)
+        names = [x for x in (self.given_name, self.family_name) if x]
+        if names:
+            return ' '.join(names)
+        return self.user_email or ''
+
     @property
     def gravatar(self):
 
@@ -73,6 +107,21 @@ class User(BaseModel):
         # return image url
         return gravatar_url
 
+    # name this user was last listed under in the user directory
+    directory_name = ndb.StringProperty(indexed=False)
+
+    def _pre_put_hook(self):
+        # only name changes affect the directory, not the
+        # frequent puts made when refreshing credentials
+        self._directory_changed = self.directory_name != self.full_name
+        self.directory_name = self.full_name
+
+    def _post_put_hook(self, future):
+        # move the user directory on to a new version so
+        # that it's rebuilt with this user's changes
+        if getattr(self, '_directory_changed', True):
+            bump_directory_version()
+
     #########################################
     # OAuth2 related methods and properties #
     #########################################
@@ -5,6 +5,7 @@ import datetime
 from google.appengine.ext import ndb
 
 # local imports
+from models import counter
 from models.base import BaseModel
 
 
@@ -34,7 +35,43 @@ class Comment(BaseModel):
         return now - self.creation_time
 
     def put(self, *args, **kwargs):
-        super(Comment, self).put(*args, **kwargs)
-        # save associated task to datastore
-        task = self.task.get()
-        task.put()
+
+        """
+        Override put() to count new comments against their task.
+        Only the comment and a counter shard are written, the
+        task and its ancestors are never touched.
+        """
+
+        # remembered until counted, so a retried transaction
+        # (which has already given the comment a key) still counts it
+        if self.key is None or self.key.id() is None:
+            self._uncounted = True
+        key = super(Comment, self).put(*args, **kwargs)
+        if getattr(self, '_uncounted', False):
+            # counted once the comment is committed (straight away
+            # outside of a transaction)
+            ndb.get_context().call_on_commit(self._count)
+        return key
+
+    def _count(self):
+        if self._uncounted:
+            self._uncounted = False
+            counter.increment(comments_counter(self.task))
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        # comments are always stored as children of their task, and
+        # are only uncounted once their deletion is committed
+        if future.get_exception() is None:
+            task_key = key.parent()
+            ndb.get_context().call_on_commit(lambda: counter.increment(comments_counter(task_key), -1))
+
+
+def comments_counter(task_key):
+
+    """
+    Returns the name of the counter holding the
+    number of comments on the given task
+    """
+
+    return 'comments:%s' % task_key.urlsafe()
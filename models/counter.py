@@ -0,0 +1,120 @@
+"""
+Sharded counters, allowing counts to be kept up to date with
+cheap writes that never touch the entity being counted.
+"""
+# stdlib imports
+import random
+
+# third-party imports
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+# local imports
+from models.base import BaseModel
+
+# number of shards each counter's writes are spread across
+NUM_SHARDS = 10
+
+# cached totals expire after this many seconds, so any that do
+# drift from their shards are put right
+COUNT_CACHE_TIME = 60 * 60
+
+# seconds a total can't be cached for after a write that found none
+# cached, longer than it takes to sum the shards
+COUNT_LOCK_TIME = 5
+
+
+class CounterShard(BaseModel):
+
+    """
+    A single shard of a named counter, the value of the
+    counter is the sum of the values of all its shards.
+    """
+
+    # name of the counter this shard belongs to
+    name = ndb.StringProperty()
+    # this shard's portion of the count
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def _cache_key(name):
+    return 'counter:%s' % name
+
+
+def _shard_keys(name):
+    return [ndb.Key(CounterShard, '%s:%d' % (name, i)) for i in range(NUM_SHARDS)]
+
+
+# shards are always updated in their own transaction, even when the
+# counted entity is being written inside another transaction
+@ndb.transactional(propagation=ndb.TransactionOptions.INDEPENDENT)
+def _increment_shard(shard_key, name, delta):
+    shard = shard_key.get()
+    if shard is None:
+        shard = CounterShard(key=shard_key, name=name)
+    shard.count += delta
+    shard.put()
+
+
+def increment(name, delta=1):
+
+    """
+    Add delta (which may be negative) to the named counter.
+    Touches a single randomly chosen shard.
+    """
+
+    shard_key = random.choice(_shard_keys(name))
+    _increment_shard(shard_key, name, delta)
+    # keep the cached total in step, if there is one
+    if delta >= 0:
+        cached = memcache.incr(_cache_key(name), delta)
+    else:
+        cached = memcache.decr(_cache_key(name), -delta)
+    # if there isn't, stop a get_count() that summed the shards before
+    # this write from caching its (now stale) total for a while
+    if cached is None:
+        memcache.delete(_cache_key(name), seconds=COUNT_LOCK_TIME)
+
+
+@ndb.transactional(xg=True)
+def _set_shards(name, count):
+    # whole count in the first shard, the rest emptied
+    shards = [CounterShard(key=x, name=name) for x in _shard_keys(name)]
+    shards[0].count = count
+    ndb.put_multi(shards)
+
+
+def set_count(name, count):
+
+    """
+    Overwrite the value of the named counter.  Unlike increment() this
+    is safe to repeat, but only while nothing else is changing it.
+    """
+
+    _set_shards(name, count)
+    memcache.delete(_cache_key(name))
+
+
+def get_count(name):
+
+    """
+    Returns the current value of the named counter,
+    summing its shards only on a cache miss.
+    """
+
+    count = memcache.get(_cache_key(name))
+    if count is None:
+        count = count_shards(name)
+        memcache.add(_cache_key(name), count, time=COUNT_CACHE_TIME)
+    return count
+
+
+def count_shards(name):
+
+    """
+    Returns the value of the named counter summed straight
+    from its stored shards, bypassing every cache.
+    """
+
+    shards = ndb.get_multi(_shard_keys(name), use_cache=False, use_memcache=False)
+    return sum([x.count for x in shards if x is not None])
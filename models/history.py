@@ -7,6 +7,7 @@ from google.appengine.ext import ndb
 
 # local imports
 from models.base import BaseModel
+from utils.fragments import bump_generation
 
 
 class History(BaseModel):
@@ -18,11 +19,19 @@ class History(BaseModel):
 
     # relationship to object that was changed
     entity = ndb.KeyProperty()
+    # keys of the entity and all its ancestors, so path layout tasks
+    # (which aren't in one entity group) can query their subtasks' history
+    path = ndb.KeyProperty(repeated=True)
     # relationship to user that made change
     user = ndb.KeyProperty()
     # text property for comment body
     description = ndb.StringProperty(indexed=False)
 
+    # names of the user and entity, copied in when the record is
+    # written so that displaying it doesn't need any further fetches
+    user_name = ndb.StringProperty(indexed=False)
+    entity_name = ndb.StringProperty(indexed=False)
+
     @property
     def when(self):
 
@@ -38,14 +47,44 @@ class History(BaseModel):
 
     @property
     def who(self):
-        user = self.user.get()
-        return user.given_name + ' ' + user.family_name
+        # fall back to fetching the user for older records
+        if self.user_name is None:
+            self.user_name = self.user.get().full_name
+        return self.user_name
 
     def what(self):
-        entity = self.entity.get()
-        entity_name = entity.name
-        entity_link = webapp2.uri_for('task-view', task_id=entity.key.urlsafe())
-        return {'name': entity_name, 'link': entity_link}
+        # fall back to fetching the entity for older records
+        if self.entity_name is None:
+            self.entity_name = self.entity.get().name
+        entity_link = webapp2.uri_for('task-view', task_id=self.entity.urlsafe())
+        return {'name': self.entity_name, 'link': entity_link}
+
+    @classmethod
+    def prefetch(cls, histories):
+
+        """
+        Fill in the user and entity names of any records written before
+        they were stored on the record, fetching all of the missing users
+        and entities together in one batch.
+        """
+
+        missing = set()
+        for history in histories:
+            if history.user_name is None:
+                missing.add(history.user)
+            if history.entity_name is None:
+                missing.add(history.entity)
+        if not missing:
+            return histories
+        # fetch all missing users/entities asynchronously in one batch
+        missing = list(missing)
+        futures = dict(zip(missing, ndb.get_multi_async(missing)))
+        for history in histories:
+            if history.user_name is None:
+                history.user_name = futures[history.user].get_result().full_name
+            if history.entity_name is None:
+                history.entity_name = futures[history.entity].get_result().name
+        return histories
 
 
 def add_to_history(task, user, description):
@@ -53,6 +92,12 @@ def add_to_history(task, user, description):
     user_key = user.key
     history = History(parent=task.key)
     history.entity = task_key
+    history.path = task.path + [task_key]
     history.user = user_key
+    history.user_name = user.full_name
+    history.entity_name = task.name
     history.description = description
-    history.put()
+    # refused if the task's project is being moved
+    task.write_checked(to_put=[history])
+    # history is shown in cached views of the task and its ancestors
+    bump_generation(task.project)
@@ -0,0 +1,256 @@
+"""
+Online migration of projects from the ancestor layout, where a whole
+project is a single entity group, to the path layout, where every task
+is a root entity and can be written independently of the rest.
+"""
+# stdlib imports
+import logging
+
+# third-party imports
+import webapp2
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+# local imports
+from models import counter
+from models.base import BaseModel
+from models.comment import Comment
+from models.comment import comments_counter
+from models.history import History
+from models.task import PATH_LAYOUT
+from models.task import Task
+from utils.fragments import bump_generation
+from utils.migration import MIGRATION_QUEUE
+
+# number of tasks moved per transaction, each one adds its new
+# entity group to the project's old one (at most 25 allowed)
+MIGRATION_BATCH_SIZE = 10
+
+# retries the migrations queue makes (task_retry_limit in queue.yaml)
+MIGRATION_RETRY_LIMIT = 5
+
+# delay before an interrupted migration is tried again from scratch
+MIGRATION_REQUEUE_COUNTDOWN = 3600
+
+
+class MigrationIncompleteError(Exception):
+    pass
+
+
+class MovedTask(BaseModel):
+
+    """
+    Record of a task's move out of its project's entity group, keyed by
+    the task's old key and stored in the project's group.  Every task's
+    new key is recorded before the first one moves, so an interrupted
+    migration carries on with exactly the same keys (found with a
+    strongly consistent ancestor query) and references between moved
+    and unmoved tasks always line up.
+    """
+
+    old_key = ndb.KeyProperty(indexed=False)
+    new_key = ndb.KeyProperty(indexed=False)
+
+    # set in the same transaction as the move, along with the
+    # number of comments copied
+    moved = ndb.BooleanProperty(default=False, indexed=False)
+    comments = ndb.IntegerProperty(default=0, indexed=False)
+    # whether the new counter has been set and the old comments deleted
+    finished = ndb.BooleanProperty(default=False, indexed=False)
+
+    @classmethod
+    def key_for(cls, project_key, old_key):
+        return ndb.Key(cls, old_key.urlsafe(), parent=project_key)
+
+
+def schedule_layout_migration(project_key, countdown=0):
+
+    """
+    Queue the migration of a project to the path layout.
+    """
+
+    task = taskqueue.Task(
+        url=webapp2.uri_for('layout-migration-worker'),
+        params={'project_key': project_key.urlsafe()},
+        countdown=countdown,
+    )
+    task.add(queue_name=MIGRATION_QUEUE)
+
+
+@ndb.transactional
+def _set_migrating(project_key, migrating, key_map=None):
+    project = project_key.get(use_cache=False)
+    project.migrating = migrating
+    # switch project over once all its tasks have moved
+    if key_map is not None:
+        project.layout = PATH_LAYOUT
+        project.subtasks = [key_map.get(x, x) for x in project.subtasks]
+    # read in this transaction, so store the subtask list as set here
+    project.put(own_totals=True)
+
+
+def _copy_task(task, key_map):
+    # copy all stored (non-computed) properties
+    values = {}
+    for name, value in task.to_dict().items():
+        prop = Task._properties.get(name)
+        if prop is not None and not isinstance(prop, ndb.ComputedProperty):
+            values[name] = value
+    copy = Task(key=key_map[task.key])
+    copy.populate(**values)
+    # point all references at the new keys
+    copy.layout = PATH_LAYOUT
+    copy.supertask = key_map.get(task.supertask, task.supertask)
+    copy.path = [key_map.get(x, x) for x in reversed(task._ancestor_keys())]
+    copy.subtasks = [key_map.get(x, x) for x in task.subtasks]
+    copy.migrated_from = task.key
+    return copy
+
+
+@ndb.transactional(xg=True)
+def _move_batch(project_key, tasks, key_map):
+
+    """
+    Copy a batch of tasks, along with their comments and history, to
+    their new root keys and delete the old tasks and history, recording
+    each move, all in one transaction.
+
+    Old comments are left for _finish_move() to delete, as deleting a
+    comment adjusts its counter outside of this transaction.
+    """
+
+    to_put = []
+    to_delete = []
+    for task in tasks:
+        new_key = key_map[task.key]
+        copy = _copy_task(task, key_map)
+        to_put.append(copy)
+        to_delete.append(task.key)
+        # copy this task's own comments
+        comments = task.comments().fetch()
+        for comment in comments:
+            to_put.append(Comment(
+                parent=new_key,
+                task=new_key,
+                user=comment.user,
+                comment=comment.comment,
+                creation_time=comment.creation_time,
+            ))
+        # move this task's own history records
+        histories = History.query(ancestor=task.key).filter(History.entity == task.key)
+        for history in histories:
+            to_put.append(History(
+                parent=new_key,
+                entity=new_key,
+                path=copy.path + [new_key],
+                user=history.user,
+                user_name=history.user_name,
+                entity_name=history.entity_name,
+                description=history.description,
+                creation_time=history.creation_time,
+            ))
+            to_delete.append(history.key)
+        to_put.append(MovedTask(
+            key=MovedTask.key_for(project_key, task.key),
+            old_key=task.key,
+            new_key=new_key,
+            moved=True,
+            comments=len(comments),
+        ))
+    ndb.put_multi(to_put)
+    ndb.delete_multi(to_delete)
+
+
+def _plan_moves(project_key, tasks, key_map):
+
+    """
+    Allocate new keys for any of the given tasks that don't have one
+    yet, and record them all before anything is moved.
+    """
+
+    unplanned = [x for x in tasks if x.key not in key_map]
+    if not unplanned:
+        return
+    first, last = Task.allocate_ids(size=len(unplanned))
+    records = []
+    for task, task_id in zip(unplanned, range(first, last + 1)):
+        key_map[task.key] = ndb.Key(Task, task_id)
+        records.append(MovedTask(
+            key=MovedTask.key_for(project_key, task.key),
+            old_key=task.key,
+            new_key=key_map[task.key],
+        ))
+    ndb.put_multi(records)
+
+
+def _finish_move(record):
+
+    """
+    Set the comment counter of a moved task and delete its old
+    comments.  Safe to repeat if interrupted.
+    """
+
+    counter.set_count(comments_counter(record.new_key), record.comments)
+    old_comments = Comment.query(ancestor=record.old_key).fetch(keys_only=True)
+    ndb.delete_multi(old_comments)
+    record.finished = True
+    record.put()
+
+
+def migrate_project_to_path_layout(project_key):
+
+    """
+    Move every task in a project (with its comments and history) out of
+    the project's entity group into its own root entity.  Tasks in the
+    project can't be written to while this runs, but can still be viewed.
+
+    Safe to re-run if interrupted: every task's new key is recorded in
+    a MovedTask before anything moves, and later runs reuse them.
+    """
+
+    project = project_key.get(use_cache=False)
+    if project is None or project.layout == PATH_LAYOUT:
+        return
+    _set_migrating(project_key, True)
+
+    # keys planned by earlier attempts, and every task still to move
+    # (both ancestor queries, so nothing is missed)
+    key_map = dict((x.old_key, x.new_key) for x in MovedTask.query(ancestor=project_key))
+    tasks = [x for x in Task.query(ancestor=project_key) if x.key != project_key]
+    tasks.sort(key=lambda x: len(x.key.pairs()))
+    _plan_moves(project_key, tasks, key_map)
+
+    # move tasks in batches, then their comments
+    for i in range(0, len(tasks), MIGRATION_BATCH_SIZE):
+        _move_batch(project_key, tasks[i:i + MIGRATION_BATCH_SIZE], key_map)
+    for record in MovedTask.query(ancestor=project_key):
+        if record.moved and not record.finished:
+            _finish_move(record)
+
+    # never switch over while anything is left in the old entity group
+    remaining = Task.query(ancestor=project_key).fetch(keys_only=True)
+    if [x for x in remaining if x != project_key]:
+        raise MigrationIncompleteError('Tasks left in project %s' % project_key.urlsafe())
+    _set_migrating(project_key, False, key_map)
+    bump_generation(project_key)
+    logging.info('Moved %d tasks of project %s to path layout', len(key_map), project_key.urlsafe())
+
+
+def migration_failed(project_key):
+
+    """
+    Called once a migration has used up all its retries.  If nothing
+    has been moved yet the project is simply unlocked, otherwise the
+    migration is queued again to carry on later (it can't be unlocked
+    half moved).
+    """
+
+    records = MovedTask.query(ancestor=project_key).fetch()
+    if not any(x.moved for x in records):
+        # forget the planned keys, a later run plans afresh
+        ndb.delete_multi([x.key for x in records])
+        _set_migrating(project_key, False)
+        logging.error('Migration of project %s failed, project unlocked', project_key.urlsafe())
+    else:
+        schedule_layout_migration(project_key, countdown=MIGRATION_REQUEUE_COUNTDOWN)
+        logging.error('Migration of project %s failed part way, queued again', project_key.urlsafe())
@@ -0,0 +1,54 @@
+"""
+Progress records for batch data migrations (see utils/migration.py)
+"""
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from models.base import BaseModel
+
+# states a migration can be in
+PENDING = 'pending'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class MigrationStatus(BaseModel):
+
+    """
+    Progress of a single migration, keyed by the migration's name.
+    Every batch stores the cursor it stopped at, so a migration
+    can be paused and resumed (or survive failures) at any point.
+    """
+
+    state = ndb.StringProperty(default=PENDING, choices=[PENDING, RUNNING, PAUSED, DONE, FAILED])
+
+    # incremented every time the migration is started from scratch,
+    # so that batches left queued from an earlier run are ignored
+    run = ndb.IntegerProperty(default=0, indexed=False)
+
+    # incremented every time the run is resumed, so resumed batches get
+    # new task names and any left queued from before are ignored
+    attempt = ndb.IntegerProperty(default=0, indexed=False)
+
+    # where the next batch starts from (None to start at the beginning)
+    cursor = ndb.StringProperty(indexed=False)
+
+    # throttling, entities per batch and seconds to wait between batches
+    batch_size = ndb.IntegerProperty(default=100, indexed=False)
+    countdown = ndb.IntegerProperty(default=0, indexed=False)
+
+    # running totals for this run
+    batches = ndb.IntegerProperty(default=0, indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    updated = ndb.IntegerProperty(default=0, indexed=False)
+
+    # error that stopped the migration, if any
+    error = ndb.StringProperty(indexed=False)
+
+    @classmethod
+    def get_for(cls, name):
+        # status of a named migration, creating it if it's never been run
+        return cls.get_or_insert(name)
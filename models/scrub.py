@@ -0,0 +1,34 @@
+"""
+Results of rollup consistency checks (see utils/scrubber.py)
+"""
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from models.base import BaseModel
+
+
+class RollupDrift(BaseModel):
+
+    """
+    Drift found in a project's stored rollups by its latest scrub,
+    keyed by the project's key.  Overwritten by every scrub.
+    """
+
+    project = ndb.KeyProperty()
+
+    # number of tasks checked, found out of date, and repaired
+    tasks = ndb.IntegerProperty(default=0, indexed=False)
+    drifted = ndb.IntegerProperty(default=0)
+    repaired = ndb.IntegerProperty(default=0, indexed=False)
+
+    # largest differences seen between stored and recalculated values
+    max_completion_drift = ndb.IntegerProperty(default=0, indexed=False)
+    max_estimate_drift = ndb.IntegerProperty(default=0, indexed=False)
+
+    # fraction of the project's tasks that had drifted
+    @property
+    def drift_ratio(self):
+        if not self.tasks:
+            return 0.0
+        return float(self.drifted) / self.tasks
@@ -1,10 +1,67 @@
+# stdlib imports
+import collections
+
 # third-party imports
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 # local imports
+from models import counter
 from models.base import BaseModel
 from models.comment import Comment
+from models.comment import comments_counter
 from models.history import History
+from utils.errors import ProjectMigratingError
+from utils.fragments import bump_generation
+from utils.rollup import schedule_rollup
+
+# storage layouts for a project's tasks.  In the ancestor layout every
+# task is a descendant of its project, so the whole project is one entity
+# group.  In the path layout every task is a root entity and its position
+# in the tree is given by its supertask and materialized path instead.
+ANCESTOR_LAYOUT = 'ancestor'
+PATH_LAYOUT = 'path'
+
+
+def average_completion(completion_sum, count):
+
+    """
+    Rolls up the completion status of a task from the sum of its
+    subtasks' completion statuses, rounding the average down to a
+    whole percent and then to the nearest 20%.
+    """
+
+    subtask_completion_avg = float(completion_sum) / count
+    return int(round(int(subtask_completion_avg) / 2.0, -1) * 2)
+
+
+# slim, cacheable copy of the fields needed to list a task
+TaskSummary = collections.namedtuple('TaskSummary', [
+    'key',
+    'name',
+    'assigned_to',
+    'time_estimate',
+    'completion_status',
+    'subtasks_count',
+])
+
+# cached summaries expire after this many seconds, so one that's
+# missed an invalidation can't be served for long
+SUMMARY_CACHE_TIME = 60 * 60
+
+
+class CoercedIntegerProperty(ndb.IntegerProperty):
+
+    """
+    IntegerProperty that also reads back values stored as floats, as
+    they were by the ComputedProperty that completion_status used to be
+    (a plain IntegerProperty reads them back as None).
+    """
+
+    def _db_get_value(self, v, unused_p):
+        if v.has_doublevalue():
+            return int(v.doublevalue())
+        return super(CoercedIntegerProperty, self)._db_get_value(v, unused_p)
 
 
 class Task(BaseModel):
@@ -41,54 +98,64 @@ class Task(BaseModel):
     # task's parent
     supertask = ndb.KeyProperty()
 
+    # storage layout of this task's project, and the materialized path
+    # of keys of all this task's ancestors (project first)
+    layout = ndb.StringProperty(default=ANCESTOR_LAYOUT, choices=[ANCESTOR_LAYOUT, PATH_LAYOUT])
+    path = ndb.KeyProperty(repeated=True)
+
+    # set on a project while its tasks are being moved to a new layout
+    migrating = ndb.BooleanProperty(default=False, indexed=False)
+
+    # key this task was stored under before its project changed layout
+    migrated_from = ndb.KeyProperty()
+
+    # completion status and time estimate are rolled up from this task's
+    # subtasks whenever it's saved and stored as regular properties, so
+    # reading them never has to walk the subtask tree
     def _completion_status(self):
         # return this task's own completion status if no subtasks
-        if not self.subtasks:
+        if not self.subtasks_count:
             return self.task_completion_status
         # calculate avg of completion status of subtasks
-        subtask_completion = [x.get().completion_status for x in self.subtasks]
-        subtask_completion = [float(x) for x in subtask_completion]
-        subtask_completion_avg = sum(subtask_completion) / len(subtask_completion)
-        return round(int(subtask_completion_avg) / 2.0, -1) * 2
-    completion_status = ndb.ComputedProperty(_completion_status)
+        return average_completion(self.subtasks_completion_sum, self.subtasks_count)
+    completion_status = CoercedIntegerProperty(default=0)
 
     # estimate of time required to complete task
     def _time_estimate(self):
         # return this task's own time estimate if no subtasks
-        if not self.subtasks:
+        if not self.subtasks_count:
             return self.task_time_estimate
         # return sum of time estimates for all immediate subtasks
-        subtask_time_estimate = sum([x.get().time_estimate for x in self.subtasks])
-        return subtask_time_estimate
-    time_estimate = ndb.ComputedProperty(_time_estimate)
-
-    # list of subtasks for this project
-    def _subtasks(self):
-        # perform ancestor query to get list of subtask keys for this entity
-        q = Task.query(ancestor=self.key)
-        q = q.filter(Task.supertask == self.key)
-        return [s for s in q.iter(keys_only=True)]
+        return self.subtasks_time_estimate
+    time_estimate = ndb.IntegerProperty(default=0)
+
+    # list of subtasks for this project, appended to whenever
+    # a new subtask is saved
     subtasks = ndb.KeyProperty(repeated=True)
 
     # simple count to make num of subtasks queryable
-    def _subtasks_count(self):
-        return len(self.subtasks)
-    subtasks_count = ndb.IntegerProperty()
+    subtasks_count = ndb.IntegerProperty(default=0)
+
+    # running totals of the rolled up values of this task's immediate
+    # subtasks, adjusted by delta whenever one of them changes
+    subtasks_completion_sum = ndb.IntegerProperty()
+    subtasks_time_estimate = ndb.IntegerProperty()
 
     # indicate if this task is top-level (i.e. a project)
     def _is_top_level(self):
         return self.supertask is None
     is_top_level = ndb.ComputedProperty(_is_top_level)
 
-    # count the number of comments for this task
-    def _comments_count(self):
-        q = Comment.query(ancestor=self.key)
-        q = q.filter(Comment.task == self.key)
-        return q.count()
-    comments_count = ndb.IntegerProperty(default=0)
+    # number of comments on this task, kept in a sharded counter so
+    # that adding or deleting a comment never has to save the task
+    @property
+    def comments_count(self):
+        return counter.get_count(comments_counter(self.key))
 
     # key of the project this task belongs to
     def _project(self):
+        if self.path:
+            return self.path[0]
         key = self.key
         while True:
             if key is None or key.parent() is None:
@@ -111,47 +178,339 @@ class Task(BaseModel):
     # repetitive actions for tasks       #
     ######################################
 
+    # keys of all this task's ancestors, closest first
+    def _ancestor_keys(self):
+        if self.layout == PATH_LAYOUT:
+            return list(reversed(self.path))
+        ancestor_keys = []
+        key = self.key.parent()
+        while key is not None:
+            ancestor_keys.append(key)
+            key = key.parent()
+        return ancestor_keys
+
+    def check_writable(self):
+
+        """
+        Raises ProjectMigratingError if this task's project is being
+        moved to another layout.
+        """
+
+        # projects themselves are never moved
+        if self.is_top_level:
+            return
+        project = self.project.get(use_cache=False)
+        if project is not None and project.migrating:
+            raise ProjectMigratingError
+
+    def write_checked(self, to_put=(), to_delete=()):
+
+        """
+        Store and delete entities belonging to this task (eg. comments
+        and history) that don't go through put().  The project is read
+        in the same transaction, so the write either lands before a
+        migration starts copying the task's entities or is refused
+        with ProjectMigratingError.
+        """
+
+        @ndb.transactional(xg=True)
+        def txn():
+            self.check_writable()
+            # put one at a time, so any put() overrides still run
+            for entity in to_put:
+                entity.put()
+            ndb.delete_multi(to_delete)
+
+        txn()
+
+    def new_subtask(self):
+
+        """
+        Returns a new (unsaved) subtask of this task, stored
+        in the same layout as the rest of its project.
+        """
+
+        if self.layout == PATH_LAYOUT:
+            return Task(layout=PATH_LAYOUT, supertask=self.key, path=self.path + [self.key])
+        return Task(parent=self.key)
+
     # List of dicts that can be used to display breadcrumbs
-    # for a particular task
+    # for a particular task, all ancestors are fetched in one batch
     def breadcrumbs(self):
-        key = self.key
+        ancestor_keys = self._ancestor_keys()
         crumbs = []
-        while True:
-            key = key.parent()
-            if key is None:
-                break
-            entity = key.get()
+        for key, entity in zip(ancestor_keys, ndb.get_multi(ancestor_keys)):
+            if entity is None:
+                continue
             crumbs.append({'name': entity.name, 'task_id': key.urlsafe()})
         return reversed(crumbs)
 
+    # projection query returning just the fields shown when listing
+    # this task's subtasks, ready to be turned into TaskSummary tuples
+    def subtask_summaries(self):
+        if self.layout == PATH_LAYOUT:
+            # subtasks are root entities (eventually consistent)
+            q = Task.query()
+        else:
+            q = Task.query(ancestor=self.key)
+        q = q.filter(Task.supertask == self.key)
+        q = q.order(Task.creation_time)
+        projection = [
+            Task.name,
+            Task.assigned_to,
+            Task.time_estimate,
+            Task.completion_status,
+            Task.subtasks_count,
+        ]
+        return q.map_async(lambda x: x.summary(), projection=projection)
+
+    # latest 10 history records for this task, loaded with
+    # a single query and ready to display without more fetches
     @property
     def history(self):
-        q = History.query(ancestor=self.key)
+        if self.layout == PATH_LAYOUT:
+            # subtasks' history isn't in this task's entity group,
+            # it's found by materialized path (eventually consistent)
+            q = History.query(History.path == self.key)
+        else:
+            q = History.query(ancestor=self.key)
         q = q.order(-History.creation_time)
-        return [h.get() for h in q.iter(limit=10, keys_only=True)]
-
-    def put(self, *args, **kwargs):
-
-        """
-        Override put() so that we can assign some extra
-        values that can't be assigned as ComputedProperties
-        due to requiring a valid key.
-        """
-
-        # save entity as normal
-        super(Task, self).put(*args, **kwargs)
-        # make task's parent queryable
-        self.supertask = self.key.parent()
-        # find this tasks's subtasks and count them
-        self.subtasks = self._subtasks()
-        self.subtasks_count = self._subtasks_count()
-        self.comments_count = self._comments_count()
-        # save the task again
-        super(Task, self).put(*args, **kwargs)
-        # if this task has a parent then save it too,
-        # which'll cause it's computed properties to
-        # be recalculated.  This should bubble up all
-        # the way to project level
-        if self.supertask is not None:
-            supertask = self.supertask.get()
-            supertask.put()
+        return History.prefetch(q.fetch(10))
+
+    def summary(self):
+        # slim copy of this task for list views
+        return TaskSummary(
+            key=self.key,
+            name=self.name,
+            assigned_to=self.assigned_to,
+            time_estimate=self.time_estimate,
+            completion_status=self.completion_status,
+            subtasks_count=self.subtasks_count,
+        )
+
+    @staticmethod
+    def _summary_cache_key(key):
+        return 'summary:%s' % key.urlsafe()
+
+    @classmethod
+    def get_summaries(cls, keys):
+
+        """
+        Returns a list of TaskSummary for the given keys, served from
+        memcache where possible.  Any misses are fetched together in
+        one batch and cached for next time.
+        """
+
+        cache_keys = [cls._summary_cache_key(x) for x in keys]
+        cached = memcache.get_multi(cache_keys)
+        missing = [x for x, y in zip(keys, cache_keys) if y not in cached]
+        if missing:
+            fetched = {}
+            for task in ndb.get_multi(missing):
+                if task is not None:
+                    fetched[cls._summary_cache_key(task.key)] = task.summary()
+            memcache.set_multi(fetched, time=SUMMARY_CACHE_TIME)
+            cached.update(fetched)
+        return [cached[x] for x in cache_keys if x in cached]
+
+    def _post_put_hook(self, future):
+        # drop cached summary so it's rebuilt with the new values, once
+        # they're committed (or a read in between could re-cache the old)
+        cache_key = self._summary_cache_key(self.key)
+        ndb.get_context().call_on_commit(lambda: memcache.delete(cache_key))
+
+    def _set_subtask_totals(self, subtasks):
+        # rebuild the running subtask totals from stored subtasks
+        subtasks = [x for x in subtasks if x is not None]
+        self.subtasks = [x.key for x in subtasks]
+        self.subtasks_count = len(subtasks)
+        self.subtasks_completion_sum = sum([x.completion_status or 0 for x in subtasks])
+        self.subtasks_time_estimate = sum([x.time_estimate or 0 for x in subtasks])
+
+    def _rollup_totals(self):
+
+        """
+        Seed the running subtask totals from the stored subtasks
+        if this entity was saved before they were tracked.
+        """
+
+        if self.subtasks_completion_sum is not None and self.subtasks_time_estimate is not None:
+            return
+        self._set_subtask_totals(ndb.get_multi(self.subtasks, use_cache=False))
+
+    def _rollup(self):
+        # recalculate rolled up values from the running totals
+        self.completion_status = self._completion_status()
+        self.time_estimate = self._time_estimate()
+
+    def _apply_subtask_delta(self, subtask_key, completion_delta, estimate_delta, is_new=False):
+
+        """
+        Apply the change in one subtask's rolled up values to this
+        task's running totals and return the resulting change in
+        this task's own rolled up values.
+        """
+
+        self._rollup_totals()
+        old_completion_status = self.completion_status or 0
+        old_time_estimate = self.time_estimate or 0
+        # count the subtask in if it's only just been created
+        if is_new:
+            self.subtasks.append(subtask_key)
+            self.subtasks_count += 1
+        self.subtasks_completion_sum += completion_delta
+        self.subtasks_time_estimate += estimate_delta
+        self._rollup()
+        return (self.completion_status - old_completion_status,
+                self.time_estimate - old_time_estimate)
+
+    @ndb.transactional(xg=True)
+    def _put_with_rollups(self, propagate=True, own_totals=False, **ctx_options):
+
+        """
+        Store this task and send the change in its rolled up values
+        up the key path as a delta.  The task and every ancestor it
+        changes are stored together in one put_multi, in a single
+        transaction.
+
+        In the ancestor layout the whole chain is updated at once (all in
+        the project's entity group).  In the path layout, where every task
+        is its own entity group, at most the immediate parent is updated
+        here so the transaction never spans more than two groups.
+
+        If propagate is False the ancestors of an existing task are left
+        untouched.  Returns the key of the first ancestor left needing a
+        refresh, or None if the whole chain is up to date.
+
+        An existing task's subtask list and totals are taken from its
+        stored copy, read in the transaction, so subtasks added or rolled
+        up since this copy was loaded aren't lost.  Pass own_totals=True
+        to store the ones set on this copy instead.
+        """
+
+        # allocate an ID up front so that a new task's key
+        # can be added to its parent's list of subtasks
+        if self.key is None or self.key.id() is None:
+            parent = self.key.parent() if self.key is not None else None
+            task_id, _ = Task.allocate_ids(size=1, parent=parent)
+            self.key = ndb.Key(Task, task_id, parent=parent)
+        # make task's parent and path queryable
+        if self.layout != PATH_LAYOUT:
+            self.supertask = self.key.parent()
+        ancestor_keys = self._ancestor_keys()
+        self.path = list(reversed(ancestor_keys))
+        # get stored copy of this task and its ancestors in one batch,
+        # in the path layout just the parent plus the project
+        fetch_keys = ancestor_keys
+        if self.layout == PATH_LAYOUT:
+            fetch_keys = ancestor_keys[:1]
+            if len(ancestor_keys) > 1:
+                fetch_keys.append(ancestor_keys[-1])
+        entities = ndb.get_multi([self.key] + fetch_keys, use_cache=False)
+        previous, ancestors = entities[0], entities[1:]
+        # refuse writes while the project's tasks are being moved
+        project = ancestors[-1] if ancestors else None
+        if project is not None and project.migrating:
+            raise ProjectMigratingError
+        if self.layout == PATH_LAYOUT:
+            ancestors = ancestors[:1]
+        if previous is not None and not own_totals:
+            self.subtasks = previous.subtasks
+            self.subtasks_count = previous.subtasks_count
+            self.subtasks_completion_sum = previous.subtasks_completion_sum
+            self.subtasks_time_estimate = previous.subtasks_time_estimate
+        # recalculate this task's own rolled up values
+        self._rollup_totals()
+        self._rollup()
+        completion_delta = self.completion_status
+        estimate_delta = self.time_estimate
+        if previous is not None:
+            completion_delta -= previous.completion_status or 0
+            estimate_delta -= previous.time_estimate or 0
+            # new tasks always have to be added to their parent straight away
+            if not propagate or self.layout == PATH_LAYOUT:
+                ancestors = []
+        # walk up the key path applying the delta until it runs out
+        changed = [self]
+        subtask_key, is_new = self.key, previous is None
+        for ancestor in ancestors:
+            if ancestor is None or not (is_new or completion_delta or estimate_delta):
+                break
+            completion_delta, estimate_delta = ancestor._apply_subtask_delta(
+                subtask_key, completion_delta, estimate_delta, is_new)
+            changed.append(ancestor)
+            subtask_key, is_new = ancestor.key, False
+        ndb.put_multi(changed, **ctx_options)
+        # anything left over is carried up by the rollup queue
+        remaining = ancestor_keys[len(changed) - 1:]
+        if remaining and (completion_delta or estimate_delta):
+            return remaining[0]
+        return None
+
+    def put(self, defer_rollup=False, own_totals=False, **ctx_options):
+
+        """
+        Override put() so that every save keeps the rolled up values
+        of this task's ancestors current.
+
+        With defer_rollup=True an edit to an existing task only stores
+        the task itself and queues a refresh of its parent instead, so
+        that a burst of edits to one project is rolled up just once.
+        Path layout projects always roll up this way past the parent.
+
+        own_totals is passed on to _put_with_rollups(), for callers that
+        set the task's subtask list or totals themselves.
+
+        Everything cached for the project is invalidated once the
+        write (and its transaction, if any) is done.
+        """
+
+        stale_key = self._put_with_rollups(propagate=not defer_rollup, own_totals=own_totals,
+                                           **ctx_options)
+        self._after_put(stale_key)
+        return self.key
+
+    def _after_put(self, stale_key):
+        # work that can't be done inside a transaction is left to
+        # whoever started it (see refresh_rollups)
+        if ndb.in_transaction():
+            return
+        if stale_key is not None:
+            schedule_rollup(stale_key)
+        bump_generation(self.project)
+
+    @classmethod
+    def refresh_rollups(cls, task_key):
+
+        """
+        Recalculate a task's subtask totals from its stored subtasks
+        and send any change up the key path.  Used by the rollup
+        worker to catch up on edits stored with defer_rollup=True.
+        """
+
+        task = task_key.get(use_cache=False)
+        if task is None:
+            return None
+        # in the path layout every subtask is in its own entity group
+        # so they have to be read before the transaction starts
+        subtasks = None
+        if task.layout == PATH_LAYOUT:
+            subtasks = ndb.get_multi(task.subtasks, use_cache=False)
+
+        @ndb.transactional(xg=True)
+        def txn():
+            task = task_key.get(use_cache=False)
+            if task is None:
+                return None
+            if subtasks is None:
+                task._set_subtask_totals(ndb.get_multi(task.subtasks, use_cache=False))
+            else:
+                task._set_subtask_totals(subtasks)
+            return task, task._put_with_rollups(own_totals=True)
+
+        result = txn()
+        if result is None:
+            return None
+        task, stale_key = result
+        task._after_put(stale_key)
+        return task.key
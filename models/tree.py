@@ -0,0 +1,242 @@
+"""
+In-memory snapshots of whole projects.  Every task in a project shares
+the project as its ancestor (or has it at the head of its materialized
+path), so a single query returns the whole tree and everything else can
+be worked out without more fetches.
+"""
+# stdlib imports
+import collections
+
+# third-party imports
+try:
+    import numpy
+except ImportError:
+    # only available where enabled in app.yaml
+    numpy = None
+
+# local imports
+from models.task import PATH_LAYOUT
+from models.task import Task
+from models.task import average_completion
+
+# snapshots smaller than this are rolled up in plain python,
+# where numpy's per-call overhead outweighs what it saves
+VECTORIZE_MIN_TASKS = 500
+
+# switch for the vectorized rollups, only ever turned on while
+# scripts/check_rollups.py passes against the deployed numpy
+VECTORIZE_ROLLUPS = True
+
+# rolled up values of a single task, as calculated from a snapshot
+Rollup = collections.namedtuple('Rollup', [
+    'completion_status',
+    'time_estimate',
+    'subtasks_count',
+    'subtasks_completion_sum',
+    'subtasks_time_estimate',
+])
+
+
+def average_completion_array(completion_sums, counts):
+
+    """
+    Vectorized average_completion().  Rounds halves away from zero,
+    exactly as python 2's round() does, rather than to even as
+    numpy.round() would.
+    """
+
+    averages = numpy.trunc(completion_sums.astype(numpy.float64) / counts)
+    halved = averages / 2.0
+    rounded = numpy.sign(halved) * numpy.floor(numpy.abs(halved) / 10.0 + 0.5) * 10.0
+    return (rounded * 2).astype(numpy.int64)
+
+
+class TaskTree(object):
+
+    """
+    A parent/child index over every task in a project, built
+    from one query.
+    """
+
+    def __init__(self, project_key, tasks):
+        self.project_key = project_key
+        # all tasks by key, and the keys of each task's
+        # immediate subtasks in creation order
+        self.tasks = {}
+        self.children = collections.defaultdict(list)
+        for task in sorted(tasks, key=lambda x: x.creation_time):
+            self.tasks[task.key] = task
+            parent_key = self.parent_key(task)
+            if parent_key is not None:
+                self.children[parent_key].append(task.key)
+
+    @classmethod
+    def load(cls, project_key):
+
+        """
+        Snapshot the whole project with a single query.  Projects in the
+        path layout are found by materialized path, which unlike the
+        ancestor query is only eventually consistent.
+        """
+
+        project = project_key.get()
+        if project is not None and project.layout == PATH_LAYOUT:
+            tasks = Task.query(Task.path == project_key).fetch()
+            return cls(project_key, [project] + tasks)
+        return cls(project_key, Task.query(ancestor=project_key).fetch())
+
+    @staticmethod
+    def parent_key(task):
+        # key of a task's parent task (None for projects)
+        if task.supertask is not None:
+            return task.supertask
+        return task.key.parent()
+
+    def __contains__(self, key):
+        return key in self.tasks
+
+    def get(self, key):
+        return self.tasks.get(key)
+
+    def rollups(self):
+
+        """
+        Calculates the rolled up values of every task in the
+        snapshot bottom-up from the tasks' own user settable
+        values, ignoring whatever is currently stored.
+
+        Large snapshots are done with vectorized numpy passes (when
+        numpy is available), both give exactly the same results
+        (checked by scripts/check_rollups.py).
+
+        Returns a dict of Rollup tuples keyed by task key.
+        """
+
+        if VECTORIZE_ROLLUPS and numpy is not None and len(self.tasks) >= VECTORIZE_MIN_TASKS:
+            return self._vectorized_rollups()
+        return self._python_rollups()
+
+    def _python_rollups(self):
+        rollups = {}
+        # walk the tree depth first, calculating each
+        # task once all of its subtasks are done
+        stack = [(self.project_key, False)]
+        while stack:
+            key, expanded = stack.pop()
+            if not expanded:
+                stack.append((key, True))
+                stack.extend((x, False) for x in self.children[key])
+                continue
+            task = self.tasks[key]
+            subtasks = [rollups[x] for x in self.children[key]]
+            completion_sum = sum(x.completion_status for x in subtasks)
+            estimate_sum = sum(x.time_estimate for x in subtasks)
+            if subtasks:
+                completion_status = average_completion(completion_sum, len(subtasks))
+                time_estimate = estimate_sum
+            else:
+                completion_status = task.task_completion_status or 0
+                time_estimate = task.task_time_estimate or 0
+            rollups[key] = Rollup(
+                completion_status=completion_status,
+                time_estimate=time_estimate,
+                subtasks_count=len(subtasks),
+                subtasks_completion_sum=completion_sum,
+                subtasks_time_estimate=estimate_sum,
+            )
+        return rollups
+
+    def columns(self):
+
+        """
+        Flattens every task in the project into parallel lists, with
+        each task always coming after its parent: keys, index of each
+        task's parent (-1 for the project), depth, and each task's own
+        completion status and time estimate.
+        """
+
+        keys = [self.project_key]
+        parents = [-1]
+        depths = [0]
+        # breadth first, appending each task's subtasks as it's reached
+        for i, key in enumerate(keys):
+            children = self.children.get(key, ())
+            keys.extend(children)
+            parents.extend([i] * len(children))
+            depths.extend([depths[i] + 1] * len(children))
+        completion = [self.tasks[x].task_completion_status or 0 for x in keys]
+        estimate = [self.tasks[x].task_time_estimate or 0 for x in keys]
+        return keys, parents, depths, completion, estimate
+
+    def _vectorized_rollups(self):
+        keys, parents, depths, completion, estimate = self.columns()
+        size = len(keys)
+        if size < 2:
+            return self._python_rollups()
+        parents = numpy.array(parents, dtype=numpy.int64)
+        depths = numpy.array(depths, dtype=numpy.int64)
+        completion = numpy.array(completion, dtype=numpy.int64)
+        estimate = numpy.array(estimate, dtype=numpy.int64)
+        # number of immediate subtasks of each task
+        counts = numpy.bincount(parents[1:], minlength=size).astype(numpy.int64)
+        completion_sums = numpy.zeros(size, dtype=numpy.int64)
+        estimate_sums = numpy.zeros(size, dtype=numpy.int64)
+        # one pass per level, deepest first, adding each level's (final)
+        # values into its parents, which are then complete themselves
+        for depth in range(depths.max(), 0, -1):
+            level = numpy.nonzero(depths == depth)[0]
+            level_parents = parents[level]
+            # bincount sums in float64, exact for any realistic total
+            completion_sums += numpy.bincount(
+                level_parents, weights=completion[level], minlength=size).astype(numpy.int64)
+            estimate_sums += numpy.bincount(
+                level_parents, weights=estimate[level], minlength=size).astype(numpy.int64)
+            above = numpy.unique(level_parents)
+            completion[above] = average_completion_array(completion_sums[above], counts[above])
+            estimate[above] = estimate_sums[above]
+        # converted back to python ints a whole column at a time
+        columns = zip(completion.tolist(), estimate.tolist(), counts.tolist(),
+                      completion_sums.tolist(), estimate_sums.tolist())
+        return dict(zip(keys, map(Rollup._make, columns)))
+
+    def stale_rollups(self, rollups=None):
+
+        """
+        Compares the rolled up values calculated by rollups() with the
+        values stored on each task.  Returns the recalculated Rollup of
+        every task that's out of date (or has the wrong subtask list),
+        keyed by task key.
+        """
+
+        if rollups is None:
+            rollups = self.rollups()
+        stale = {}
+        for key, rollup in rollups.items():
+            task = self.tasks[key]
+            if any(getattr(task, x) != y for x, y in rollup._asdict().items()):
+                stale[key] = rollup
+            # subtask lists only need fixing if they hold the wrong keys
+            elif set(task.subtasks) != set(self.children[key]):
+                stale[key] = rollup
+        return stale
+
+    def apply_rollup(self, task, rollup):
+        # set recalculated values on a (possibly freshly fetched) task
+        task.populate(**rollup._asdict())
+        if set(task.subtasks) != set(self.children[task.key]):
+            task.subtasks = list(self.children[task.key])
+
+    def apply_rollups(self):
+
+        """
+        Sets the rolled up values calculated by rollups() on every task
+        in the snapshot.  Returns the tasks whose stored values were out
+        of date, ready to be stored with put_multi.
+        """
+
+        stale = []
+        for key, rollup in self.stale_rollups().items():
+            task = self.tasks[key]
+            self.apply_rollup(task, rollup)
+            stale.append(task)
+        return stale
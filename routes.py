@@ -34,6 +34,32 @@ ROUTES = [
         strict_slash=True,
     ),
 
+    RedirectRoute(
+        r'/admin/migrations/',
+        'handlers.template.migrations.MigrationsHandler',
+        name="migrations",
+        handler_method='get',
+        strict_slash=True,
+        methods=['GET'],
+    ),
+
+    Route(
+        r'/admin/migrations/<name>/<action>/',
+        'handlers.template.migrations.MigrationsHandler',
+        name="migration-action",
+        handler_method='post',
+        methods=['POST'],
+    ),
+
+    RedirectRoute(
+        r'/t/<task_id>/migrate_layout/',
+        'handlers.template.forms.MigrateProjectLayoutHandler',
+        name="task-migrate-layout",
+        handler_method='post',
+        strict_slash=True,
+        methods=['POST'],
+    ),
+
     ####################################
     # User facing template/form routes #
     ####################################
@@ -111,6 +137,70 @@ ROUTES = [
         strict_slash=True,
     ),
 
+    ##############
+    # API routes #
+    ##############
+
+    Route(
+        r'/api/t/<task_id>/users/',
+        'handlers.api.users.UserDirectoryHandler',
+        name="api-users",
+        methods=['GET'],
+    ),
+
+    #############################
+    # Task queue and cron jobs #
+    #############################
+
+    Route(
+        r'/_queue/rollup/',
+        'handlers.queue.rollup.RollupHandler',
+        name="rollup-worker",
+        methods=['POST'],
+    ),
+
+    Route(
+        r'/_queue/layout/',
+        'handlers.queue.layout.LayoutMigrationHandler',
+        name="layout-migration-worker",
+        methods=['POST'],
+    ),
+
+    Route(
+        r'/_queue/migration/',
+        'handlers.queue.migration.MigrationHandler',
+        name="migration-worker",
+        methods=['POST'],
+    ),
+
+    Route(
+        r'/_queue/scrub/',
+        'handlers.queue.scrub.ScrubHandler',
+        name="scrub-worker",
+        methods=['POST'],
+    ),
+
+    Route(
+        r'/_cron/sentry/',
+        'handlers.queue.sentry.FlushSentryHandler',
+        name="sentry-cron",
+        methods=['GET'],
+    ),
+
+    Route(
+        r'/_cron/scrub/',
+        'handlers.queue.scrub.ScheduleScrubsHandler',
+        name="scrub-cron",
+        methods=['GET'],
+    ),
+
+    Route(
+        r'/_ah/warmup',
+        'handlers.warmup.WarmupHandler',
+        name="warmup",
+        methods=['GET'],
+    ),
+
     #############################
     # Auth/Login related routes #
     #############################
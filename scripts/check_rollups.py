@@ -0,0 +1,117 @@
+"""
+Checks that TaskTree's vectorized (numpy) rollups give exactly the same
+results as the plain python ones, on generated trees of every shape:
+single tasks, long chains, wide fans, random trees and trees with unset
+values.  Exits non-zero on the first mismatch.  Run with the appengine
+SDK and numpy importable, eg.
+
+    python scripts/check_rollups.py [number of random trees]
+
+Must pass before VECTORIZE_ROLLUPS is turned on (or numpy upgraded).
+"""
+# stdlib imports
+import collections
+import datetime
+import os
+import random
+import sys
+
+# project root, one up from this script
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, PROJECT_ROOT)
+
+# put the SDK's bundled libraries on the path, if we can find it
+try:
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+except ImportError:
+    pass
+
+
+class CheckKey(collections.namedtuple('CheckKey', ['id'])):
+
+    """
+    Stand-in for a task's key.  Generated tasks always have their
+    supertask set, so the tree never needs a real key's parent.
+    """
+
+    def parent(self):
+        return None
+
+
+# the only fields of a task that rollups are calculated from
+CheckTask = collections.namedtuple('CheckTask', [
+    'key',
+    'supertask',
+    'creation_time',
+    'task_completion_status',
+    'task_time_estimate',
+])
+
+
+def generate_tasks(rng, size, shape='random'):
+
+    """
+    Returns a list of size CheckTasks forming a single project, with
+    the project first.  Shapes are 'chain' (every task the subtask of
+    the one before), 'fan' (every task a subtask of the project) or
+    'random' (every task a subtask of any earlier one).
+    """
+
+    start = datetime.datetime(2013, 1, 1)
+    tasks = []
+    for i in range(size):
+        if i == 0:
+            supertask = None
+        elif shape == 'chain':
+            supertask = tasks[-1].key
+        elif shape == 'fan':
+            supertask = tasks[0].key
+        else:
+            supertask = rng.choice(tasks).key
+        # leave some values unset, as on older tasks
+        completion = rng.choice([None, 0, 20, 40, 50, 60, 80, 100, rng.randint(0, 100)])
+        estimate = rng.choice([None, 0, rng.randint(0, 1000), rng.randint(0, 10 ** 6)])
+        tasks.append(CheckTask(
+            key=CheckKey(i + 1),
+            supertask=supertask,
+            # shuffled creation times, so subtask order isn't key order
+            creation_time=start + datetime.timedelta(seconds=rng.randint(0, 10 ** 6)),
+            task_completion_status=completion,
+            task_time_estimate=estimate,
+        ))
+    return tasks
+
+
+def check_tree(tasks):
+    # returns the key of the first task whose rollups differ, or None
+    from models.tree import TaskTree
+    tree = TaskTree(tasks[0].key, tasks)
+    expected = tree._python_rollups()
+    actual = tree._vectorized_rollups()
+    if set(expected) != set(actual):
+        return tasks[0].key
+    for key in sorted(expected):
+        if expected[key] != actual[key]:
+            return key
+    return None
+
+
+def main(trees=200):
+    rng = random.Random(0)
+    cases = [('single', 1), ('pair', 2)]
+    cases.extend(('chain', x) for x in (3, 50, 600))
+    cases.extend(('fan', x) for x in (3, 50, 600))
+    cases.extend(('random', rng.randint(3, 2000)) for _ in range(trees))
+    for shape, size in cases:
+        tasks = generate_tasks(rng, size, shape)
+        mismatch = check_tree(tasks)
+        if mismatch is not None:
+            print 'MISMATCH in %s tree of %d tasks at %r' % (shape, size, mismatch)
+            return 1
+    print '%d trees checked, vectorized rollups match' % len(cases)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(x) for x in sys.argv[1:2]]))
@@ -0,0 +1,111 @@
+"""
+Precompiles everything in templates/ into importable python modules,
+so that instances never have to parse and compile templates from
+source.  Run before every deploy (with the appengine SDK's webapp2 and
+jinja2 importable), eg.
+
+    python scripts/compile_templates.py
+
+A manifest of the hash of every template source is written alongside
+the compiled templates.  Run with --check (eg. as the last step before
+deploying) to fail if any template has been added or changed since
+they were compiled.
+
+Templates are compiled with the same environment settings as
+webapp2_extras.jinja2 uses, and are only used outside of DEBUG
+(see settings.WSGI_CONFIG).
+"""
+# stdlib imports
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+# third-party imports
+import jinja2
+from webapp2_extras.jinja2 import default_config
+
+# project root, one up from this script
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, PROJECT_ROOT)
+
+# settings expects to be running under appengine
+os.environ.setdefault('SERVER_SOFTWARE', 'Development/compile_templates')
+
+# local imports
+import settings
+
+
+def source_hashes(source_path):
+    # sha1 of every template under source_path, keyed by name
+    hashes = {}
+    for root, dirs, files in os.walk(source_path):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, source_path).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                hashes[name] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+
+
+def check_templates():
+
+    """
+    Returns the names of templates added, changed or removed since
+    they were last compiled (all of them if they never have been).
+    """
+
+    source_path = os.path.join(settings.PROJECT_ROOT, default_config['template_path'])
+    hashes = source_hashes(source_path)
+    try:
+        with open(settings.COMPILED_TEMPLATES_MANIFEST) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return sorted(hashes)
+    names = set(hashes) | set(manifest)
+    return sorted(x for x in names if hashes.get(x) != manifest.get(x))
+
+
+def compile_templates():
+
+    """
+    Compile every template into COMPILED_TEMPLATES_PATH,
+    replacing anything compiled there before.
+    """
+
+    source_path = os.path.join(settings.PROJECT_ROOT, default_config['template_path'])
+    target_path = settings.COMPILED_TEMPLATES_PATH
+    if os.path.isdir(target_path):
+        shutil.rmtree(target_path)
+    os.makedirs(target_path)
+
+    environment = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(source_path),
+        **default_config['environment_args']
+    )
+    environment.compile_templates(
+        target_path,
+        zip=None,
+        log_function=lambda x: sys.stdout.write(x + '\n'),
+        ignore_errors=False,
+        # appengine only imports .py sources
+        py_compile=False,
+    )
+    # record what was compiled, for --check
+    with open(settings.COMPILED_TEMPLATES_MANIFEST, 'w') as f:
+        json.dump(source_hashes(source_path), f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompile templates')
+    parser.add_argument('--check', action='store_true',
+                        help='only check the compiled templates are up to date')
+    args = parser.parse_args()
+    if args.check:
+        stale = check_templates()
+        for name in stale:
+            print 'out of date: %s' % name
+        sys.exit(1 if stale else 0)
+    compile_templates()
@@ -0,0 +1,137 @@
+"""
+Profiles the imports done by a cold instance: the WSGI app itself,
+then every handler module it routes to (as the first request to each
+would).  Prints the time spent importing each module, both on its own
+and including everything it imported, and exits non-zero if the total
+goes more than settings.IMPORT_TIME_TOLERANCE over the recorded
+baseline.  Run with the appengine SDK importable, eg.
+
+    python scripts/profile_imports.py [--limit N] [--record]
+
+The check fails until a baseline has been recorded (with --record, on
+a checkout with the SDK and secrets.py in place, and committed), and it
+should be re-recorded whenever imports are deliberately made heavier
+or lighter.
+"""
+# stdlib imports
+import __builtin__
+import argparse
+import json
+import os
+import sys
+import time
+
+# project root, one up from this script
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, PROJECT_ROOT)
+
+# settings expects to be running under appengine
+os.environ.setdefault('SERVER_SOFTWARE', 'Development/profile_imports')
+
+# put the SDK's bundled libraries on the path, if we can find it
+try:
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+except ImportError:
+    pass
+
+
+class ImportProfiler(object):
+
+    """
+    Wraps __import__ to time the first import of every module.
+    """
+
+    def __init__(self):
+        # total (inclusive) and own (exclusive) seconds per module
+        self.total = {}
+        self.own = {}
+        self._stack = []
+        self._import = __builtin__.__import__
+
+    def __enter__(self):
+        __builtin__.__import__ = self._profiled_import
+        return self
+
+    def __exit__(self, *args):
+        __builtin__.__import__ = self._import
+
+    def _profiled_import(self, name, *args, **kwargs):
+        # only time modules being loaded for the first time
+        if name in sys.modules:
+            return self._import(name, *args, **kwargs)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            self.total[name] = self.total.get(name, 0.0) + elapsed
+            self.own[name] = self.own.get(name, 0.0) + elapsed - children
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def step(self, func):
+        # time a single top level step
+        start = time.time()
+        func()
+        return time.time() - start
+
+
+def check_budget(total, record=False):
+
+    """
+    Compare a total import time (in ms) with the recorded baseline, or
+    record it as the new baseline.  Returns the script's exit status.
+    """
+
+    import settings
+    path = settings.IMPORT_TIME_BASELINE_PATH
+    if record:
+        with open(path, 'w') as f:
+            json.dump({'total_ms': round(total, 1)}, f, indent=2)
+        print 'baseline recorded in %s' % path
+        return 0
+    try:
+        with open(path) as f:
+            baseline = json.load(f)['total_ms']
+    except (IOError, ValueError, KeyError):
+        # an unrecorded budget can't be checked, so it never passes
+        print 'no baseline recorded in %s, record one with --record' % path
+        return 1
+    budget = baseline * (1 + settings.IMPORT_TIME_TOLERANCE)
+    print '%-50s %10.1f (budget %.1f)' % ('baseline', baseline, budget)
+    return 0 if total <= budget else 1
+
+
+def main(limit=25, record=False):
+    with ImportProfiler() as profiler:
+        # appengine_config is always imported first
+        steps = [('appengine_config', profiler.step(lambda: __import__('appengine_config')))]
+        steps.append(('app', profiler.step(lambda: __import__('app'))))
+        import routes
+        import webapp2
+        for route in routes.ROUTES:
+            if isinstance(route.handler, basestring):
+                module = route.handler.rsplit('.', 1)[0]
+                if module not in sys.modules:
+                    steps.append((module, profiler.step(lambda: webapp2.import_string(route.handler))))
+
+    print '%-50s %10s %10s' % ('module', 'own (ms)', 'total (ms)')
+    for name in sorted(profiler.own, key=profiler.own.get, reverse=True)[:limit]:
+        print '%-50s %10.1f %10.1f' % (name, profiler.own[name] * 1000, profiler.total[name] * 1000)
+    print
+    for name, secs in steps:
+        print '%-50s %10.1f' % (name, secs * 1000)
+    total = sum(x[1] for x in steps) * 1000
+    print '%-50s %10.1f' % ('total', total)
+    return check_budget(total, record=record)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile cold instance imports')
+    parser.add_argument('--limit', type=int, default=25, help='number of modules to list')
+    parser.add_argument('--record', action='store_true', help='record this run as the baseline')
+    args = parser.parse_args()
+    sys.exit(main(limit=args.limit, record=args.record))
@@ -20,3 +20,25 @@ WSGI_CONFIG = {
         'secret_key': secrets.SESSION_KEY,
     }
 }
+
+# Templates precompiled by scripts/compile_templates.py, used in place
+# of the template sources (outside of DEBUG) whenever they've been built.
+# Whether they're up to date is checked at build time (compile_templates.py
+# --check), so starting an instance never reads the sources
+COMPILED_TEMPLATES_PATH = os.path.join(PROJECT_ROOT, 'templates_compiled')
+COMPILED_TEMPLATES_MANIFEST = os.path.join(COMPILED_TEMPLATES_PATH, 'manifest.json')
+if os.path.isfile(COMPILED_TEMPLATES_MANIFEST):
+    WSGI_CONFIG['webapp2_extras.jinja2'] = {
+        'compiled_path': COMPILED_TEMPLATES_PATH,
+    }
+
+# Storage layout given to new projects, either 'ancestor' (each project is
+# one entity group) or 'path' (every task is its own entity group, see
+# models/layout.py)
+DEFAULT_TASK_LAYOUT = 'ancestor'
+
+# Time taken (in ms) by a cold instance to import the app and every
+# handler module, as recorded by scripts/profile_imports.py --record.
+# Later profiles fail if they're more than IMPORT_TIME_TOLERANCE over it
+IMPORT_TIME_BASELINE_PATH = os.path.join(PROJECT_ROOT, 'scripts', 'import_baseline.json')
+IMPORT_TIME_TOLERANCE = 0.2
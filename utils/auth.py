@@ -1,12 +1,67 @@
 # third-party imports
+import webapp2
+from google.appengine.api import memcache
 from google.appengine.api import users
 
+# local imports
+from models.auth import User
+
+# how long (in seconds) project memberships are cached for
+ACL_CACHE_TIME = 60 * 60
+
+
+class Principal(object):
+
+    """
+    The user making the current request.  The user's datastore
+    entity and appengine admin flag are each looked up at most
+    once per request, however many times they're used.
+    """
+
+    def __init__(self, google_user):
+        # user as returned by the appengine users api (None if logged out)
+        self.google_user = google_user
+
+    @webapp2.cached_property
+    def user_entity(self):
+        # get user entity from datastore
+        if self.google_user is None:
+            return None
+        return User.get_by_id('user-' + self.google_user.user_id())
+
+    @webapp2.cached_property
+    def is_app_admin(self):
+        # is the user an admin of the app on appengine
+        return users.is_current_user_admin()
+
+    @property
+    def is_admin(self):
+        if self.is_app_admin:
+            return True
+        return self.user_entity is not None and bool(self.user_entity.is_admin)
+
+
+def get_principal(request=None):
+
+    """
+    Returns the Principal for the given (or current) request,
+    creating it the first time it's asked for.
+    """
+
+    if request is None:
+        request = webapp2.get_request()
+    principal = request.registry.get('principal')
+    if principal is None:
+        principal = Principal(users.get_current_user())
+        request.registry['principal'] = principal
+    return principal
+
 
 def is_admin(user):
 
     # check if the currently logged in user
     # is an admin of the app on appengine
-    if users.is_current_user_admin():
+    if get_principal().is_app_admin:
         return True
 
     # check if passed user is marked as a local admin
@@ -16,6 +71,38 @@ def is_admin(user):
     return False
 
 
+def _acl_cache_key(project_key, user_key):
+    return 'acl:%s:%s' % (project_key.urlsafe(), user_key.urlsafe())
+
+
+def is_project_member(project_key, user_key):
+
+    """
+    Check if a user is a member of a project.  Memberships
+    (and non-memberships) are cached per (project, user) pair
+    so the project only has to be fetched on a cache miss.
+    """
+
+    cache_key = _acl_cache_key(project_key, user_key)
+    member = memcache.get(cache_key)
+    if member is None:
+        project = project_key.get()
+        member = project is not None and user_key in project.users
+        memcache.add(cache_key, member, time=ACL_CACHE_TIME)
+    return member
+
+
+def set_project_member(project_key, user_key, member):
+
+    """
+    Update the cached membership of a user in a project,
+    should be called whenever a project's users change.
+    """
+
+    cache_key = _acl_cache_key(project_key, user_key)
+    memcache.set(cache_key, member, time=ACL_CACHE_TIME)
+
+
 def authed_for_task(task, user):
 
     # check if user is an admin
@@ -23,7 +110,7 @@ def authed_for_task(task, user):
         return True
 
     # check if user has permissions for this task
-    if user.key in task.project.get().users:
+    if is_project_member(task.project, user.key):
         return True
 
     return False
@@ -0,0 +1,204 @@
+"""
+Migrations that backfill data added to existing models since they
+were first stored.  Run from the migrations admin page.
+"""
+# stdlib imports
+import collections
+
+# third-party imports
+from google.appengine.ext import ndb
+
+# local imports
+from models import counter
+from models.comment import comments_counter
+from models.history import History
+from models.task import ANCESTOR_LAYOUT
+from models.task import Task
+from models.tree import TaskTree
+from utils.fragments import bump_generation
+from utils.migration import Migration
+
+# properties no longer part of the Task model that
+# older entities may still have stored
+OBSOLETE_TASK_PROPERTIES = ['comments_count']
+
+# tasks re-read and stored per transaction
+UPDATE_BATCH_SIZE = 100
+
+
+def _stale_path(task):
+    # older tasks have no parent or materialized path stored
+    if task.layout != ANCESTOR_LAYOUT:
+        return False
+    path = list(reversed(task._ancestor_keys()))
+    return task.supertask != task.key.parent() or task.path != path
+
+
+def _obsolete_properties(task):
+    # properties left over from older versions of the model
+    return [x for x in OBSOLETE_TASK_PROPERTIES if x in task._properties and x not in Task._properties]
+
+
+@ndb.transactional
+def _update_group(tree, rollups, keys):
+
+    """
+    Re-read the given tasks (all in one entity group) and store their
+    recalculated rollups and fixed up fields, leaving everything else as
+    stored.  Tasks written since the snapshot was taken are skipped,
+    the write will have rolled them up itself.
+    """
+
+    updated = []
+    for task in ndb.get_multi(keys, use_cache=False):
+        if task is None or task.modification_time != tree.get(task.key).modification_time:
+            continue
+        if task.key not in rollups and not _stale_path(task) and not _obsolete_properties(task):
+            continue
+        if task.key in rollups:
+            tree.apply_rollup(task, rollups[task.key])
+        if _stale_path(task):
+            task.supertask = task.key.parent()
+            task.path = list(reversed(task._ancestor_keys()))
+        for name in _obsolete_properties(task):
+            task._properties[name]._delete_value(task)
+            del task._properties[name]
+        updated.append(task)
+    ndb.put_multi(updated)
+    return len(updated)
+
+
+class TaskRollupsMigration(Migration):
+
+    """
+    Recalculates the stored rollups of every task in each project from
+    scratch and fills in the parent/path fields of older tasks.
+
+    Only the fields this migration owns are written, each entity group
+    in its own transaction, so edits made while it runs aren't lost.
+    """
+
+    name = 'task-rollups'
+    description = 'Store rolled up totals, parent and path on every task'
+    # whole projects are migrated at once
+    batch_size = 5
+
+    def query(self):
+        return Task.query(Task.is_top_level == True)
+
+    def migrate(self, project):
+        tree = TaskTree.load(project.key)
+        # only ancestor layout snapshots are strongly consistent enough
+        # to recalculate from, path layout projects have always stored
+        # their rollups since they were created
+        rollups = {}
+        if project.layout == ANCESTOR_LAYOUT:
+            rollups = tree.stale_rollups()
+        stale = [key for key, task in tree.tasks.items()
+                 if key in rollups or _stale_path(task) or _obsolete_properties(task)]
+
+        # group tasks by entity group (one per project in the
+        # ancestor layout, one per task in the path layout)
+        groups = collections.defaultdict(list)
+        for key in stale:
+            groups[key.root()].append(key)
+        updated = 0
+        for keys in groups.values():
+            for i in range(0, len(keys), UPDATE_BATCH_SIZE):
+                updated += _update_group(tree, rollups, keys[i:i + UPDATE_BATCH_SIZE])
+        if updated:
+            bump_generation(project.key)
+        # every update has been stored already
+        return []
+
+
+class CommentCountersMigration(Migration):
+
+    """
+    Brings every task's sharded comment counter in line with the
+    number of comments actually stored for it.
+    """
+
+    name = 'comment-counters'
+    description = 'Count existing comments into the sharded comment counters'
+
+    def query(self):
+        return Task.query()
+
+    def migrate(self, task):
+        # counters can only be adjusted, so add the difference
+        # from the stored shards (the cached total may be stale)
+        actual = task.comments().count()
+        delta = actual - counter.count_shards(comments_counter(task.key))
+        if delta:
+            counter.increment(comments_counter(task.key), delta)
+        return []
+
+
+class HistoryNamesMigration(Migration):
+
+    """
+    Stores the user and task names on history records saved
+    before they were denormalized.
+    """
+
+    name = 'history-names'
+    description = 'Store user and task names on older history records'
+
+    def query(self):
+        return History.query()
+
+    def migrate_batch(self, histories):
+        histories = [x for x in histories if x.user_name is None or x.entity_name is None]
+        # fetch every referenced user and task in one batch
+        keys = set()
+        for history in histories:
+            keys.update([history.user, history.entity])
+        keys = [x for x in keys if x is not None]
+        entities = dict(zip(keys, ndb.get_multi(keys)))
+        to_put = []
+        for history in histories:
+            user = entities.get(history.user)
+            entity = entities.get(history.entity)
+            if history.user_name is None and user is not None:
+                history.user_name = user.full_name
+            if history.entity_name is None and entity is not None:
+                history.entity_name = entity.name
+            to_put.append(history)
+        return to_put
+
+
+class HistoryPathsMigration(Migration):
+
+    """
+    Stores the materialized path on history records saved before it
+    was, so path layout tasks can find their subtasks' history.
+    """
+
+    name = 'history-paths'
+    description = 'Store the task path on older history records'
+
+    def query(self):
+        return History.query()
+
+    def migrate_batch(self, histories):
+        histories = [x for x in histories if not x.path and x.entity is not None]
+        # fetch every referenced task in one batch
+        keys = list(set(x.entity for x in histories))
+        entities = dict(zip(keys, ndb.get_multi(keys)))
+        to_put = []
+        for history in histories:
+            entity = entities.get(history.entity)
+            if entity is not None:
+                history.path = entity.path + [entity.key]
+                to_put.append(history)
+        return to_put
+
+
+# all available migrations by name
+MIGRATIONS = dict((x.name, x) for x in [
+    TaskRollupsMigration(),
+    CommentCountersMigration(),
+    HistoryNamesMigration(),
+    HistoryPathsMigration(),
+])
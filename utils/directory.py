@@ -0,0 +1,139 @@
+"""
+A cached, sorted index of all users that can be searched by name
+prefix without querying the datastore.
+
+The index is split into shards by the first letter of each user's
+name, and each shard into chunks small enough to stay well under
+memcache's 1MB value limit, so a search only fetches the chunks of
+the one shard its prefix falls in.
+"""
+# stdlib imports
+import bisect
+import collections
+import logging
+
+# third-party imports
+from google.appengine.api import memcache
+
+# local imports
+from models.auth import User
+from models.auth import get_directory_version
+
+# number of results returned per page of a search
+PAGE_SIZE = 10
+
+# users stored per memcache value (roughly 100 bytes each)
+CHUNK_SIZE = 1000
+
+# cached directories expire after this many seconds, so those
+# left behind by newer versions don't hang around
+DIRECTORY_CACHE_TIME = 60 * 60 * 24
+
+
+def _shard_name(search_name):
+    # shard a user is listed in
+    return search_name[:1]
+
+
+def _index_key(version):
+    return 'user-directory:%d' % version
+
+
+def _chunk_key(version, shard, chunk):
+    return 'user-directory:%d:%s:%d' % (version, shard.encode('utf-8'), chunk)
+
+
+def _build_directory(version):
+
+    """
+    Build every shard of the directory from a single query and cache
+    it under the given version.  Returns a dict of sorted shards.
+    """
+
+    shards = collections.defaultdict(list)
+    for user in User.query():
+        name = user.full_name
+        # users with no name or email can't be searched for
+        if not name:
+            continue
+        shards[_shard_name(name.lower())].append((name.lower(), user.key.urlsafe(), name))
+
+    # index of the number of chunks in each shard, stored last
+    # so it's only ever found once all the chunks are cached
+    index = {}
+    mapping = {}
+    for shard, entries in shards.items():
+        entries.sort()
+        chunks = [entries[i:i + CHUNK_SIZE] for i in range(0, len(entries), CHUNK_SIZE)]
+        index[shard] = len(chunks)
+        for i, chunk in enumerate(chunks):
+            mapping[_chunk_key(version, shard, i)] = chunk
+    failed = memcache.set_multi(mapping, time=DIRECTORY_CACHE_TIME)
+    if failed:
+        logging.warning('Failed to cache %d chunks of the user directory', len(failed))
+    else:
+        memcache.set(_index_key(version), index, time=DIRECTORY_CACHE_TIME)
+    return shards
+
+
+def get_directory(prefix=''):
+
+    """
+    Returns a list of (search_name, user_key, display_name) tuples for
+    every user whose lowercased name could start with prefix (the whole
+    directory if prefix is empty), sorted by lowercased name.  The
+    directory is built once and cached under the current directory
+    version, which moves on whenever a user's name changes.
+    """
+
+    prefix = prefix.lower()
+    version = get_directory_version()
+    index = memcache.get(_index_key(version))
+    if index is None:
+        shards = _build_directory(version)
+    else:
+        # fetch just the chunks of the shards needed
+        keys = []
+        for shard, count in index.items():
+            if shard == _shard_name(prefix) or not prefix:
+                keys.extend(_chunk_key(version, shard, i) for i in range(count))
+        chunks = memcache.get_multi(keys)
+        if len(chunks) < len(keys):
+            shards = _build_directory(version)
+        else:
+            shards = collections.defaultdict(list)
+            for shard, count in index.items():
+                for i in range(count):
+                    shards[shard].extend(chunks.get(_chunk_key(version, shard, i), []))
+
+    if prefix:
+        return shards.get(_shard_name(prefix), [])
+    directory = []
+    for shard in sorted(shards):
+        directory.extend(shards[shard])
+    return directory
+
+
+def search_directory(prefix, offset=0, limit=PAGE_SIZE, exclude=()):
+
+    """
+    Returns a page of users whose name starts with prefix, along with
+    the offset of the next page (or None if this is the last page).
+    Users whose keys are in exclude are skipped.
+    """
+
+    prefix = prefix.lower()
+    directory = get_directory(prefix)
+    # binary search for the first matching entry
+    position = bisect.bisect_left(directory, (prefix,)) + offset
+    results = []
+    while position < len(directory) and directory[position][0].startswith(prefix):
+        if len(results) == limit:
+            return results, offset
+        search_name, user_key, name = directory[position]
+        position += 1
+        offset += 1
+        if user_key in exclude:
+            continue
+        results.append({'key': user_key, 'name': name})
+    return results, None
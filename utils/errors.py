@@ -9,3 +9,7 @@ class UnauthorisedError(Exception):
 
 class AccessTokenRefreshError(Exception):
     pass
+
+
+class ProjectMigratingError(Exception):
+    pass
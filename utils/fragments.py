@@ -0,0 +1,75 @@
+"""
+Cache of rendered page fragments (eg. a task's subtask table), kept in
+memcache under the task's key and its project's generation number.
+
+Every project has a single generation counter, embedded in the key of
+everything cached for the project.  Any write to the project bumps it
+once, which invalidates every fragment cached for every task in the
+project without having to find or delete any of them.
+"""
+# stdlib imports
+import time
+
+# third-party imports
+from google.appengine.api import memcache
+
+# rendered fragments expire after this many seconds regardless, so
+# relative times ("5 minutes ago") in them never get too far out
+FRAGMENT_CACHE_TIME = 300
+
+
+def _generation_key(project_key):
+    return 'generation:%s' % project_key.urlsafe()
+
+
+def _fragment_key(name, task_key, generation):
+    return 'fragment:%s:%s:%d' % (name, task_key.urlsafe(), generation)
+
+
+def _initial_generation():
+    # generations start from the current time, so one evicted from
+    # memcache never restarts at a number it's already used
+    return int(time.time())
+
+
+def get_generation(project_key):
+    # current generation of a project's cached data
+    generation = memcache.get(_generation_key(project_key))
+    if generation is None:
+        memcache.add(_generation_key(project_key), _initial_generation())
+        generation = memcache.get(_generation_key(project_key)) or _initial_generation()
+    return generation
+
+
+def bump_generation(project_key):
+
+    """
+    Invalidate everything cached for a project.
+    """
+
+    memcache.incr(_generation_key(project_key), initial_value=_initial_generation())
+
+
+def get_fragments(task_key, generation, names):
+
+    """
+    Returns a dict of the named fragments that are cached
+    for this task in this generation of its project.
+    """
+
+    keys = dict((_fragment_key(x, task_key, generation), x) for x in names)
+    cached = memcache.get_multi(keys.keys())
+    return dict((keys[x], y) for x, y in cached.items())
+
+
+def set_fragments(task_key, generation, fragments):
+
+    """
+    Cache rendered fragments (a dict of html by name) for
+    this task in this generation of its project.
+    """
+
+    memcache.set_multi(
+        dict((_fragment_key(x, task_key, generation), y) for x, y in fragments.items()),
+        time=FRAGMENT_CACHE_TIME,
+    )
@@ -0,0 +1,210 @@
+"""
+Runner for data migrations that rewrite existing entities in the
+background.  A migration walks a query in fixed-size batches, each
+batch running in its own task queue request and queueing the next,
+with progress recorded in a MigrationStatus after every batch.
+"""
+# stdlib imports
+import abc
+import logging
+
+# third-party imports
+import webapp2
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+# local imports
+from models import migration as status
+from models.migration import MigrationStatus
+
+# task queue that migration batches are run on (see queue.yaml)
+MIGRATION_QUEUE = 'migrations'
+
+
+class Migration(object):
+
+    """
+    Base class for all migrations.  Subclasses name themselves, give
+    the query to walk and say how the entities it returns are migrated,
+    either one at a time with migrate() or a page at a time by
+    overriding migrate_batch().
+
+    migrate(entity) returns the list of entities that need storing
+    (empty if it's already up to date, or if it stores its own changes)
+    and must be safe to run more than once on the same entity.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    # unique name used for the migration's status and task names
+    name = None
+    # short description shown on the migrations page
+    description = ''
+    # batch size used when none is given at start
+    batch_size = 100
+
+    @abc.abstractmethod
+    def query(self):
+        # query to walk, must be usable with cursors
+        pass
+
+    def migrate_batch(self, entities):
+        # override to migrate a whole batch at once (eg. to batch fetches)
+        to_put = []
+        for entity in entities:
+            to_put.extend(self.migrate(entity))
+        return to_put
+
+    def finish(self):
+        # called once after the last batch
+        pass
+
+
+def _schedule_batch(name, migration_status):
+    # name batches after their position, so a batch requeued by a
+    # retried request is only ever run once per run and attempt
+    task = taskqueue.Task(
+        url=webapp2.uri_for('migration-worker'),
+        params={'name': name, 'run': migration_status.run, 'attempt': migration_status.attempt},
+        name='migration-%s-%d-%d-%d' % (name, migration_status.run, migration_status.attempt,
+                                        migration_status.batches),
+        countdown=migration_status.countdown,
+    )
+    try:
+        task.add(queue_name=MIGRATION_QUEUE)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def start_migration(migration, batch_size=None, countdown=0):
+
+    """
+    Start (or restart) a migration from the beginning.
+    """
+
+    @ndb.transactional
+    def txn():
+        migration_status = MigrationStatus.get_for(migration.name)
+        migration_status.populate(
+            state=status.RUNNING,
+            run=migration_status.run + 1,
+            attempt=0,
+            cursor=None,
+            batch_size=batch_size or migration.batch_size,
+            countdown=countdown,
+            batches=0,
+            processed=0,
+            updated=0,
+            error=None,
+        )
+        migration_status.put()
+        return migration_status
+
+    _schedule_batch(migration.name, txn())
+
+
+def pause_migration(migration):
+
+    """
+    Stop a running migration after its current batch.
+    """
+
+    @ndb.transactional
+    def txn():
+        migration_status = MigrationStatus.get_for(migration.name)
+        if migration_status.state == status.RUNNING:
+            migration_status.state = status.PAUSED
+            migration_status.put()
+
+    txn()
+
+
+def resume_migration(migration, batch_size=None, countdown=None):
+
+    """
+    Carry on a paused or failed migration from the batch it stopped
+    at, optionally with new throttling settings.
+    """
+
+    @ndb.transactional
+    def txn():
+        migration_status = MigrationStatus.get_for(migration.name)
+        if migration_status.state not in (status.PAUSED, status.FAILED):
+            return None
+        migration_status.state = status.RUNNING
+        migration_status.attempt += 1
+        migration_status.error = None
+        if batch_size:
+            migration_status.batch_size = batch_size
+        if countdown is not None:
+            migration_status.countdown = countdown
+        migration_status.put()
+        return migration_status
+
+    migration_status = txn()
+    if migration_status is not None:
+        _schedule_batch(migration.name, migration_status)
+
+
+def run_batch(migration, run, attempt):
+
+    """
+    Migrate one batch of entities starting from the stored cursor,
+    record progress and queue the next batch.  Does nothing if the
+    migration has been paused, resumed or restarted since the batch
+    was queued.
+    """
+
+    migration_status = MigrationStatus.get_for(migration.name)
+    if migration_status.state != status.RUNNING:
+        return
+    if migration_status.run != run or migration_status.attempt != attempt:
+        return
+
+    # fetch the next page and migrate everything on it
+    start_cursor = None
+    if migration_status.cursor is not None:
+        start_cursor = Cursor(urlsafe=migration_status.cursor)
+    try:
+        entities, cursor, more = migration.query().fetch_page(
+            migration_status.batch_size, start_cursor=start_cursor)
+        to_put = migration.migrate_batch(entities)
+        ndb.put_multi(to_put)
+    except Exception as e:
+        # stop here, the migration can be resumed from this batch
+        logging.exception('Migration %s failed', migration.name)
+        migration_status.state = status.FAILED
+        migration_status.error = unicode(e)
+        migration_status.put()
+        return
+
+    # record progress
+    migration_status.batches += 1
+    migration_status.processed += len(entities)
+    migration_status.updated += len(to_put)
+    if more and cursor is not None:
+        migration_status.cursor = cursor.urlsafe()
+    else:
+        migration_status.cursor = None
+        migration_status.state = status.DONE
+
+    @ndb.transactional
+    def txn():
+        # don't overwrite a restart or pause that came in while this batch ran
+        stored = migration_status.key.get()
+        if stored.run != run or stored.attempt != attempt:
+            return False
+        if stored.state == status.PAUSED and migration_status.state == status.RUNNING:
+            migration_status.state = status.PAUSED
+        migration_status.put()
+        return True
+
+    if not txn():
+        return
+    if migration_status.state == status.RUNNING:
+        _schedule_batch(migration.name, migration_status)
+    elif migration_status.state == status.DONE:
+        migration.finish()
+        logging.info('Migration %s done, %d of %d entities updated', migration.name,
+                     migration_status.updated, migration_status.processed)
@@ -0,0 +1,41 @@
+# stdlib imports
+import time
+
+# third-party imports
+import webapp2
+from google.appengine.api import taskqueue
+
+# task queue that rollup refreshes are sent to (see queue.yaml)
+ROLLUP_QUEUE = 'rollups'
+
+# length (in seconds) of the window in which repeated
+# refresh requests for the same task are coalesced
+ROLLUP_WINDOW = 10
+
+
+def schedule_rollup(task_key, window=ROLLUP_WINDOW):
+
+    """
+    Queue a refresh of the rolled up values of the given task
+    and its ancestors.
+
+    Every request for the same task within one window gets the same task
+    name, so the task queue drops all but the first and a burst of edits
+    is rolled up once, when the window closes.
+    """
+
+    now = time.time()
+    # name the task after the key and the window it falls into
+    name = 'rollup-%s-%d' % (task_key.urlsafe(), int(now / window))
+    task = taskqueue.Task(
+        url=webapp2.uri_for('rollup-worker'),
+        params={'task_key': task_key.urlsafe()},
+        name=name,
+        countdown=window - (now % window),
+    )
+    try:
+        task.add(queue_name=ROLLUP_QUEUE)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        # a refresh is already pending for this window
+        return False
+    return True
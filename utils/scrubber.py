@@ -0,0 +1,134 @@
+"""
+Background check of stored rollups.  Each project is snapshotted with
+a single query, its rollups are recalculated bottom-up from scratch and
+any task whose stored values have drifted is repaired.
+"""
+# stdlib imports
+import logging
+
+# third-party imports
+import webapp2
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+# local imports
+from models.scrub import RollupDrift
+from models.task import PATH_LAYOUT
+from models.task import Task
+from models.tree import TaskTree
+from utils.fragments import bump_generation
+
+# task queue that project scrubs are run on (see queue.yaml)
+SCRUB_QUEUE = 'scrubs'
+
+# tasks repaired per transaction in the ancestor layout (all in
+# the project's one entity group)
+SCRUB_BATCH_SIZE = 20
+
+
+def schedule_scrubs():
+
+    """
+    Queue a scrub of every project, one task queue request each.
+    """
+
+    url = webapp2.uri_for('scrub-worker')
+    queue = taskqueue.Queue(SCRUB_QUEUE)
+    cursor, more, count = None, True, 0
+    while more:
+        keys, cursor, more = Task.query(Task.is_top_level == True).fetch_page(
+            100, start_cursor=cursor, keys_only=True)
+        if keys:
+            queue.add([taskqueue.Task(url=url, params={'project_key': x.urlsafe()}) for x in keys])
+        count += len(keys)
+    return count
+
+
+def _repair_batch(tree, rollups):
+
+    """
+    Store recalculated rollups on the given tasks in one transaction,
+    skipping any task written since the snapshot was taken (the write
+    will have rolled it up itself, or the next scrub will catch it).
+    """
+
+    @ndb.transactional
+    def txn():
+        keys = rollups.keys()
+        repaired = []
+        for task in ndb.get_multi(keys, use_cache=False):
+            if task is None or task.modification_time != tree.get(task.key).modification_time:
+                continue
+            tree.apply_rollup(task, rollups[task.key])
+            repaired.append(task)
+        # stored directly, the values are already consistent
+        # so there's nothing to send up the tree
+        ndb.put_multi(repaired)
+        return len(repaired)
+
+    return txn()
+
+
+def _refresh_tasks(tree, keys):
+
+    """
+    Repair tasks in a path layout project, deepest first, each in its
+    own transaction.  Every task's totals are recalculated from its
+    stored subtask list and its subtasks read by key, never from the
+    (eventually consistent) snapshot.
+    """
+
+    repaired = 0
+    for key in sorted(keys, key=lambda x: len(tree.get(x).path), reverse=True):
+        if Task.refresh_rollups(key) is not None:
+            repaired += 1
+    return repaired
+
+
+def scrub_project(project_key, repair=True):
+
+    """
+    Check (and optionally repair) the stored rollups of every task in
+    a project.  Returns the RollupDrift recorded for the project.
+
+    Projects in the path layout are snapshotted by an eventually
+    consistent query, so their drifted tasks are refreshed from their
+    stored subtasks rather than repaired from the snapshot.
+    """
+
+    tree = TaskTree.load(project_key)
+    if project_key not in tree:
+        return None
+    rollups = tree.rollups()
+    stale = tree.stale_rollups(rollups)
+
+    # measure how far the stored values had drifted
+    drift = RollupDrift(id=project_key.urlsafe(), project=project_key, tasks=len(rollups))
+    drift.drifted = len(stale)
+    for key, rollup in stale.items():
+        task = tree.get(key)
+        drift.max_completion_drift = max(drift.max_completion_drift,
+                                         abs(rollup.completion_status - (task.completion_status or 0)))
+        drift.max_estimate_drift = max(drift.max_estimate_drift,
+                                       abs(rollup.time_estimate - (task.time_estimate or 0)))
+
+    # repair in batches (straight from the snapshot only when
+    # it's strongly consistent)
+    if repair and stale:
+        keys = stale.keys()
+        if tree.get(project_key).layout == PATH_LAYOUT:
+            drift.repaired += _refresh_tasks(tree, keys)
+        else:
+            for i in range(0, len(keys), SCRUB_BATCH_SIZE):
+                batch = dict((x, stale[x]) for x in keys[i:i + SCRUB_BATCH_SIZE])
+                drift.repaired += _repair_batch(tree, batch)
+        if drift.repaired:
+            bump_generation(project_key)
+
+    drift.put()
+    if drift.drifted:
+        logging.warning('Rollup drift in project %s: %d/%d tasks (%.1f%%), max completion %d, '
+                        'max estimate %d, %d repaired', project_key.urlsafe(), drift.drifted,
+                        drift.tasks, drift.drift_ratio * 100, drift.max_completion_drift,
+                        drift.max_estimate_drift, drift.repaired)
+    return drift
@@ -0,0 +1,194 @@
+"""
+Error reporting to sentry that never makes a request wait.
+
+Events are built and encoded as usual by raven, but rather than being
+posted to sentry straight away they're added to a pull queue.  A cron
+job leases them in batches and delivers them in the background, leaving
+anything that couldn't be delivered on the queue to be retried.
+
+To keep the cost of an error storm bounded, repeats of the same error
+are counted rather than reported every time, and circuit breakers stop
+both queueing and delivery for a while when either keeps failing.
+
+Delivery only depends on secrets.SENTRY_DSN, so it can be tried against
+a local stand-in server by pointing the DSN at it.
+"""
+# stdlib imports
+import hashlib
+import logging
+import sys
+
+# third-party imports
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+# local imports
+import secrets
+
+# pull queue events wait on until delivered (see queue.yaml)
+SENTRY_QUEUE = 'sentry'
+
+# number of events delivered per lease, and how long they're leased
+# for (they go back on the queue if not delivered in time)
+FLUSH_BATCH_SIZE = 50
+FLUSH_LEASE_SECONDS = 60
+
+# repeats of an error are counted over this many seconds, reporting
+# the first few and then only one in every SAMPLE_EVERY after that
+DEDUP_WINDOW = 300
+REPORT_FIRST = 3
+SAMPLE_EVERY = 100
+
+
+class CircuitBreaker(object):
+
+    """
+    Shared (memcache backed) circuit breaker.  Trips after threshold
+    consecutive failures and stays open for cooldown seconds, after
+    which the next call is let through to try again.
+    """
+
+    def __init__(self, name, threshold, cooldown):
+        self.open_key = 'breaker:%s:open' % name
+        self.failures_key = 'breaker:%s:failures' % name
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def is_open(self):
+        return bool(memcache.get(self.open_key))
+
+    def failure(self):
+        failures = memcache.incr(self.failures_key, initial_value=0)
+        if failures is not None and failures >= self.threshold:
+            memcache.set(self.open_key, True, time=self.cooldown)
+            memcache.delete(self.failures_key)
+            logging.warning('Circuit breaker %s tripped for %ds', self.open_key, self.cooldown)
+
+    def success(self):
+        memcache.delete(self.failures_key)
+
+
+# stops requests building and queueing events when the queue is failing,
+# and the flush worker delivering them while sentry is unreachable
+queue_breaker = CircuitBreaker('sentry-queue', threshold=5, cooldown=60)
+delivery_breaker = CircuitBreaker('sentry-delivery', threshold=1, cooldown=300)
+
+
+# raven client, built on first use so that importing this module
+# (done by every handler) doesn't import raven
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from utils.sentry_client import QueuedClient
+        _client = QueuedClient(secrets.SENTRY_DSN)
+    return _client
+
+
+def fingerprint(exc_info):
+
+    """
+    Cheap fingerprint of an exception, its type and the file and
+    line of every frame in its traceback, worked out without
+    building the full event.
+    """
+
+    exc_type, _, tb = exc_info
+    parts = [exc_type.__module__, exc_type.__name__]
+    while tb is not None:
+        parts.append('%s:%d' % (tb.tb_frame.f_code.co_filename, tb.tb_lineno))
+        tb = tb.tb_next
+    return hashlib.md5('|'.join(parts)).hexdigest()
+
+
+def _count_occurrence(fingerprint):
+    # number of times this error has happened in the current window
+    key = 'sentry:seen:%s' % fingerprint
+    memcache.add(key, 0, time=DEDUP_WINDOW)
+    count = memcache.incr(key)
+    # without memcache every error is reported
+    return count or 1
+
+
+def should_report(occurrences):
+    # report the first few repeats, then sample
+    return occurrences <= REPORT_FIRST or occurrences % SAMPLE_EVERY == 0
+
+
+def capture_exception(request):
+
+    """
+    Queue a report of the exception currently being handled,
+    along with details of the request it happened in.  Repeats
+    of the same error are only counted, bar a sample, and nothing
+    is captured at all while the queue breaker is open.
+    """
+
+    exc_info = sys.exc_info()
+    if queue_breaker.is_open():
+        logging.warning('Sentry reporting suspended, not capturing %s', exc_info[0].__name__)
+        return
+    error_fingerprint = fingerprint(exc_info)
+    occurrences = _count_occurrence(error_fingerprint)
+    if not should_report(occurrences):
+        return
+
+    # build our error report
+    error_report = {
+        'method': request.method,
+        'url': request.path_url,
+        'query_string': request.query_string,
+        'headers': dict(request.headers),
+        'env': dict((
+                ('REMOTE_ADDR', request.environ['REMOTE_ADDR']),
+                ('SERVER_NAME', request.environ['SERVER_NAME']),
+                ('SERVER_PORT', request.environ['SERVER_PORT']),
+            )),
+        }
+    interface = 'sentry.interfaces.Http'
+
+    # tell sentry how often this error has been seen lately
+    extra = {'fingerprint': error_fingerprint, 'occurrences': occurrences}
+
+    try:
+        get_client().captureException(exc_info, data={interface: error_report}, extra=extra)
+    except Exception:
+        # reporting an error must never cause another one
+        logging.exception('Unable to capture exception for sentry')
+
+
+def flush_events(max_batches=10):
+
+    """
+    Deliver queued events to sentry in batches.  Stops at the first
+    failure (sentry is most likely down), leaving the rest of the
+    batch to be leased again once its lease runs out, and trips the
+    delivery breaker so nothing is tried again until it resets.
+    Returns the number of events delivered.
+    """
+
+    if delivery_breaker.is_open():
+        return 0
+    queue = taskqueue.Queue(SENTRY_QUEUE)
+    client = get_client()
+    delivered = 0
+    for _ in range(max_batches):
+        tasks = queue.lease_tasks(FLUSH_LEASE_SECONDS, FLUSH_BATCH_SIZE)
+        if not tasks:
+            break
+        done = []
+        for task in tasks:
+            if not client.deliver(task.payload):
+                break
+            done.append(task)
+        if done:
+            queue.delete_tasks(done)
+        delivered += len(done)
+        if len(done) < len(tasks):
+            logging.warning('Sentry delivery failed, %d events left queued', len(tasks) - len(done))
+            delivery_breaker.failure()
+            break
+        delivery_breaker.success()
+    return delivered
@@ -0,0 +1,42 @@
+"""
+Raven client used by utils/sentry.py, kept separate so that raven
+is only imported once there's an error to report
+"""
+# stdlib imports
+import logging
+
+# third-party imports
+from google.appengine.api import taskqueue
+from raven import Client
+
+# local imports
+from utils.sentry import SENTRY_QUEUE
+from utils.sentry import queue_breaker
+
+
+class QueuedClient(Client):
+
+    """
+    Raven client that queues encoded events instead of sending them
+    """
+
+    def send(self, auth_header=None, **data):
+        # encode here, while we still have the event, and queue it
+        message = self.encode(data)
+        try:
+            taskqueue.Queue(SENTRY_QUEUE).add(taskqueue.Task(payload=message, method='PULL'))
+        except taskqueue.Error:
+            logging.warning('Unable to queue sentry event')
+            queue_breaker.failure()
+        else:
+            queue_breaker.success()
+
+    def deliver(self, message):
+
+        """
+        Send an already encoded event to sentry right away.
+        Returns False if it couldn't be delivered.
+        """
+
+        self.send_encoded(message)
+        return not self.state.did_fail()